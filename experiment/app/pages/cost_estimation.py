@@ -7,18 +7,28 @@ import pandas as pd
 st.set_page_config(layout="wide")
 
 # Set the path to the artifacts folder
-data = pd.DataFrame()
+frames = []
 for run_id in st.session_state.run_ids:
     cost_estimation_folder = f"artifacts/{run_id}/llm/cost_estimations/"
     if not os.path.exists(cost_estimation_folder):
         continue
 
-    # load each json file from cost_estimation_folder
-    for file in os.listdir(cost_estimation_folder):
-        with open(os.path.join(cost_estimation_folder, file), 'r') as f:
-            data_add = pd.DataFrame(json.load(f), index=[file])
-    
-            data = pd.concat([data, data_add])
+    files = [os.path.join(cost_estimation_folder, file) for file in os.listdir(cost_estimation_folder)]
+    # one parquet file per resource and step
+    frames.extend(pd.read_parquet(file) for file in files if file.endswith(".parquet"))
+    # runs from before the parquet format wrote one json file per call
+    legacy_rows = []
+    for file in files:
+        if file.endswith(".json"):
+            with open(file, 'r') as f:
+                legacy_rows.append(json.load(f))
+    if len(legacy_rows) > 0:
+        frames.append(pd.DataFrame(legacy_rows))
+
+if len(frames) == 0:
+    st.warning("No cost estimations found.")
+    st.stop()
+data = pd.concat(frames, ignore_index=True)
 
 tabs = st.tabs(["Individual Call Costs", "Aggregate Costs"])
 
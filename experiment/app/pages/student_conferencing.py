@@ -5,7 +5,7 @@ import pandas as pd
 from experiment.pipeline.resources._file_store_bucket import FileStoreClient
 from experiment.pipeline.resources._document_parser import DocumentParserClient
 from experiment.prompt import StudentConferencingDirector, StudentConferencingInstructionStyles
-from experiment.prompt._directors import call_gpt
+from experiment.prompt._directors import call_gpt_stream
 
 
 st.set_page_config(layout="wide")
@@ -96,7 +96,5 @@ with st.chat_message("user"):
 
 prompt = prompt_director.build_prompt(teacher_model, essay_context_input, student_text, teacher_feedback, student_query)
 
-llm_response = call_gpt(prompt)
-
 with st.chat_message("ai"):
-    st.write(llm_response)
\ No newline at end of file
+    llm_response = st.write_stream(call_gpt_stream(prompt))
\ No newline at end of file
@@ -55,13 +55,14 @@ prompt_layer_job = define_asset_job(
 
 data_processing_job = define_asset_job(
     name="data_processing",
-    selection=[experiment_init] + load_assets_from_modules([data_processing]),
+    # essay_context_index is derived from an existing essay_context materialization, so per-group runs rebuild it
+    selection=[experiment_init, user_data.essay_context_index] + load_assets_from_modules([data_processing]),
     description="Run the data processing assets."
 )
 
 feedback_job = define_asset_job(
     name="feedback_generation",
-    selection=[experiment_init] + load_assets_from_modules([feedback_generation_task]),
+    selection=[experiment_init, user_data.essay_context_index] + load_assets_from_modules([feedback_generation_task]),
     description="Run feedback generation assets."
 )
 
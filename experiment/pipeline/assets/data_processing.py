@@ -1,7 +1,7 @@
 from dagster import asset, get_dagster_logger, AssetExecutionContext
 from experiment.pipeline.resources import EmbeddingModel, VectorStore, EmbeddingPreprocessor, TrackingClient
 from dagster import Config
-from experiment.pipeline.models import Feedback, EssayContext, ClassDocument
+from experiment.pipeline.models import Feedback, EssayContextIndex, ClassDocument
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.text_splitter import NLTKTextSplitter
 from langchain_experimental.text_splitter import SemanticChunker
@@ -57,23 +57,67 @@ def chunked_feedback(context: AssetExecutionContext, experiment_init, teacher_fe
 @asset(group_name=GROUP_NAME)
 def feedback_embeddings(
     chunked_feedback: list[Feedback], 
-    essay_context: list[EssayContext], 
+    essay_context_index: EssayContextIndex, 
     embedding_model: EmbeddingModel, 
-    embedding_preprocessor: EmbeddingPreprocessor) -> list[Feedback]:
+    embedding_preprocessor: EmbeddingPreprocessor,
+    vector_store: VectorStore) -> list[Feedback]:
     """Create embeddings to form the semantic search index for few-shot teacher feedback."""
 
-    chunked_feedback = embedding_preprocessor.preprocess_feedback_index(chunked_feedback, essay_context)
-    for feedback in chunked_feedback:
-        feedback.index_embeddings = embedding_model.embed(feedback.index_text)
+    chunked_feedback = embedding_preprocessor.preprocess_feedback_index(chunked_feedback, essay_context_index)
+    if vector_store.is_persisted("feedback_vector_store", chunked_feedback, embedding_model.fingerprint):
+        logger.info("Feedback index is already persisted, skipping embedding.")
+        return chunked_feedback
+    to_embed = chunked_feedback
+    if vector_store.open_latest("feedback_vector_store", embedding_model.fingerprint):
+        # feedback_vector_store updates the latest index, so only new or edited feedback needs embedding
+        to_embed = vector_store.missing(chunked_feedback)
+        logger.info(f"{len(chunked_feedback) - len(to_embed)} feedback samples are already indexed, embedding the other {len(to_embed)}")
+    embed_feedback(to_embed, embedding_model)
     logger.debug(f"EXAMPLE feedback: {chunked_feedback[0]}")
     return chunked_feedback
 
 
+def embed_feedback(feedback: list[Feedback], embedding_model: EmbeddingModel) -> None:
+    # embed every chunk in one call so the embedding model can batch requests, then map back in order
+    index_texts = [text for fb in feedback for text in fb.index_text]
+    index_embeddings = embedding_model.embed(index_texts) if len(index_texts) > 0 else []
+    offset = 0
+    for fb in feedback:
+        fb.index_embeddings = index_embeddings[offset:offset + len(fb.index_text)]
+        offset += len(fb.index_text)
+
+
+def embed_class_documents(class_documents: list[ClassDocument], embedding_model: EmbeddingModel) -> None:
+    chunks = [chunk for class_doc in class_documents for chunk in class_doc.chunks]
+    chunk_embeddings = embedding_model.embed(chunks) if len(chunks) > 0 else []
+    offset = 0
+    for class_doc in class_documents:
+        class_doc.embeddings = chunk_embeddings[offset:offset + len(class_doc.chunks)]
+        offset += len(class_doc.chunks)
+
+
+def log_vector_store(vector_store: VectorStore, tracking_client: TrackingClient, asset_key: str) -> None:
+    """Log the index contents, or only where it lives when it is persisted, so a memory-mapped index is never copied out."""
+    if vector_store.path is not None:
+        logger.info(f"{asset_key} index is persisted at {vector_store.path}")
+        tracking_client.log_artifact(data={"index_path": vector_store.path}, filename="index.json", mode="overwrite", asset_key=asset_key)
+    else:
+        tracking_client.log_artifact(data=vector_store.to_frame(), filename="embeddings.parquet", asset_key=asset_key)
+
+
 @asset(group_name=GROUP_NAME)
-def feedback_vector_store(feedback_embeddings, tracking_client: TrackingClient, vector_store: VectorStore):
+def feedback_vector_store(feedback_embeddings, embedding_model: EmbeddingModel, tracking_client: TrackingClient, vector_store: VectorStore):
     """Store the feedback index in a vector store with metadata."""
-    vector_store.store_feedback(feedback_embeddings)
-    tracking_client.log_artifact(data=vector_store._vectors, filename="embeddings.parquet", asset_key="feedback_vector_store")
+    if any(fb.index_embeddings is None for fb in feedback_embeddings) and not vector_store.is_persisted("feedback_vector_store", feedback_embeddings, embedding_model.fingerprint):
+        # embedding was skipped for an index that is no longer on disk (removed, or replaced by another run)
+        needed = feedback_embeddings
+        if vector_store.open_latest("feedback_vector_store", embedding_model.fingerprint):
+            needed = vector_store.missing(feedback_embeddings)
+        needed = [fb for fb in needed if fb.index_embeddings is None]
+        logger.warning(f"The persisted feedback index changed since feedback_embeddings ran, embedding {len(needed)} feedback samples again")
+        embed_feedback(needed, embedding_model)
+    vector_store.store_feedback(feedback_embeddings, embedding_model_name=embedding_model.fingerprint)
+    log_vector_store(vector_store, tracking_client, asset_key="feedback_vector_store")
     return vector_store
 
 
@@ -100,16 +144,23 @@ def chunked_class_documents(context: AssetExecutionContext, experiment_init, cla
 
 
 @asset(group_name=GROUP_NAME)
-def class_document_embeddings(chunked_class_documents: list[ClassDocument], embedding_model: EmbeddingModel) -> list[ClassDocument]:
+def class_document_embeddings(chunked_class_documents: list[ClassDocument], embedding_model: EmbeddingModel, vector_store: VectorStore) -> list[ClassDocument]:
     """Create embeddings to form the semantic search index for class documents."""
-    for class_doc in chunked_class_documents:
-        class_doc.embeddings = embedding_model.embed(class_doc.chunks)
+    if vector_store.is_persisted("class_document_vector_store", chunked_class_documents, embedding_model.fingerprint):
+        logger.info("Class document index is already persisted, skipping embedding.")
+        return chunked_class_documents
+    embed_class_documents(chunked_class_documents, embedding_model)
     return chunked_class_documents
 
 
 @asset(group_name=GROUP_NAME)
-def class_document_vector_store(class_document_embeddings: list[ClassDocument], tracking_client: TrackingClient, vector_store: VectorStore):
+def class_document_vector_store(class_document_embeddings: list[ClassDocument], embedding_model: EmbeddingModel, tracking_client: TrackingClient, vector_store: VectorStore):
     """Store the class document index in a vector store with metadata."""
-    vector_store.store_class_context(class_document_embeddings)
-    tracking_client.log_artifact(data=vector_store._vectors, filename="embeddings.parquet", asset_key="class_document_vector_store")
+    needed = [class_doc for class_doc in class_document_embeddings if class_doc.embeddings is None]
+    if len(needed) > 0 and not vector_store.is_persisted("class_document_vector_store", class_document_embeddings, embedding_model.fingerprint):
+        # embedding was skipped for an index that is no longer on disk
+        logger.warning(f"The persisted class document index is gone since class_document_embeddings ran, embedding {len(needed)} documents again")
+        embed_class_documents(needed, embedding_model)
+    vector_store.store_class_context(class_document_embeddings, embedding_model_name=embedding_model.fingerprint)
+    log_vector_store(vector_store, tracking_client, asset_key="class_document_vector_store")
     return vector_store
\ No newline at end of file
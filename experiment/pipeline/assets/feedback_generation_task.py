@@ -1,10 +1,11 @@
 from dagster import asset, get_dagster_logger, Config, AssetExecutionContext
 from pydantic import Field
-from experiment.pipeline.resources import EmbeddingModel, FileStoreBucket, VectorStore, LLM, EmbeddingPreprocessor, TrackingClient, MockLLMResponse
-from experiment.pipeline.models import FeedbackRequest, EssayContext
+from experiment.pipeline.resources import EmbeddingModel, FileStoreBucket, VectorStore, LLM, EmbeddingPreprocessor, TrackingClient, MockLLMResponse, PartialResponsesError
+from experiment.pipeline.models import FeedbackRequest, EssayContextIndex
 from datetime import datetime
 from typing import Optional
-from experiment.prompt import FeedbackGenerationInstructionStyles, FeedbackGenerationDirector
+from experiment.prompt import FeedbackGenerationInstructionStyles, FeedbackGenerationDirector, FeedbackGenerationLayouts
+from experiment.utils import PACKING_STRATEGIES
 
 
 GROUP_NAME = "feedback_generation_task"
@@ -24,6 +25,9 @@ class FeedbackGenerationPromptConfig(Config):
     max_essay_context_tokens: int = 5000
     max_class_context_tokens: int = 1500
     max_feedback_example_tokens: int = 2000
+    packing_strategy: str = Field(default="greedy", examples=PACKING_STRATEGIES)
+    # PREFIX_CACHE orders sections from most to least shared, for providers with prompt caching
+    layout: str = Field(default=FeedbackGenerationLayouts.DEFAULT.name, examples=list(FeedbackGenerationLayouts.__members__.keys()))
 
 
 class RetrievalConfig(Config):
@@ -31,6 +35,7 @@ class RetrievalConfig(Config):
     similarity_score: str = "cosine"
     threshold: float = 0.6
     top_k: int = 3
+    report_recall: bool = False
 
 
 @asset(group_name=GROUP_NAME)
@@ -47,7 +52,7 @@ def feedback_retrieval(
     context: AssetExecutionContext,
     feedback_vector_store, 
     feedback_request: list[FeedbackRequest], 
-    essay_context: list[EssayContext], 
+    essay_context_index: EssayContextIndex, 
     embedding_model: EmbeddingModel, 
     embedding_preprocessor: EmbeddingPreprocessor,
     tracking_client: TrackingClient,
@@ -64,14 +69,19 @@ def feedback_retrieval(
     tracking_client.log_asset_config(config, asset_key=context.asset_key)
 
     # prepare feedback_request for searching
-    feedback_request = embedding_preprocessor.preprocess_feedback_search(feedback_request, essay_context)
+    feedback_request = embedding_preprocessor.preprocess_feedback_search(feedback_request, essay_context_index)
 
-    # embed search query
-    for request in feedback_request:
-        request.search_query_embedding = embedding_model.embed(request.search_query_text)
+    # embed search queries in one call so the embedding model can batch requests
+    search_query_embeddings = embedding_model.embed([request.search_query_text for request in feedback_request], input_type="search_query")
+    for request, embedding in zip(feedback_request, search_query_embeddings):
+        request.search_query_embedding = embedding
     
     # search feedback_vector_store
     results = feedback_vector_store.search(feedback_request, config.similarity_score, config.threshold, config.top_k)
+    if config.report_recall:
+        recall = feedback_vector_store.evaluate_recall(feedback_request, config.similarity_score, config.top_k)
+        tracking_client.log_metric(context.asset_key, f"recall_at_{config.top_k}", recall)
+        logger.info(f"Retrieval recall@{config.top_k} against exact search: {recall:.3f}")
     tracking_client.log_artifact(data=results, filename="retrieval_results.csv", asset_key="feedback_retrieval")
     if results.shape[0] == 0:
         logger.warning("No feedback examples retrieved.")
@@ -79,7 +89,7 @@ def feedback_retrieval(
     # group results by request_id
     feedback_examplars = {req_id: [] for req_id in results.request_id.unique()}
     for idx, row in results.iterrows():
-        results_columns = ['feedback_text', 'highlighted_text_chunk']
+        results_columns = ['feedback_text', 'highlighted_text_chunk', 'score']
         replace_cols = {"highlighted_text_chunk": "highlighted_text"}
         feedback_examplars[row['request_id']].append(row[results_columns].rename(replace_cols).to_dict())
     
@@ -91,7 +101,7 @@ def class_context_retrieval(
     context: AssetExecutionContext,
     class_document_vector_store, 
     feedback_request: list[FeedbackRequest], 
-    essay_context: list[EssayContext], 
+    essay_context_index: EssayContextIndex, 
     embedding_model: EmbeddingModel,
     embedding_preprocessor: EmbeddingPreprocessor,
     tracking_client: TrackingClient,
@@ -107,19 +117,24 @@ def class_context_retrieval(
     
     tracking_client.log_asset_config(config, asset_key=context.asset_key)
 
-    feedback_request = embedding_preprocessor.preprocess_feedback_search(feedback_request, essay_context)
+    feedback_request = embedding_preprocessor.preprocess_feedback_search(feedback_request, essay_context_index)
 
-    for request in feedback_request:
-        request.search_query_embedding = embedding_model.embed(request.search_query_text)
+    search_query_embeddings = embedding_model.embed([request.search_query_text for request in feedback_request], input_type="search_query")
+    for request, embedding in zip(feedback_request, search_query_embeddings):
+        request.search_query_embedding = embedding
 
     results = class_document_vector_store.search(feedback_request, config.similarity_score, config.threshold, config.top_k)
+    if config.report_recall:
+        recall = class_document_vector_store.evaluate_recall(feedback_request, config.similarity_score, config.top_k)
+        tracking_client.log_metric(context.asset_key, f"recall_at_{config.top_k}", recall)
+        logger.info(f"Retrieval recall@{config.top_k} against exact search: {recall:.3f}")
     tracking_client.log_artifact(data=results, filename="retrieval_results.csv", asset_key="class_context_retrieval")
     if results.shape[0] == 0:
         logger.warning("No class context examples retrieved.")
         return {}
     class_context_examplars = {req_id: [] for req_id in results.request_id.unique()}
     for idx, row in results.iterrows():
-        results_columns = ['text', 'name']
+        results_columns = ['text', 'name', 'score']
         rename_cols = {"text": "document_content", "name": "document_name"}
         class_context_examplars[row['request_id']].append(row[results_columns].rename(rename_cols).to_dict())
     logger.info(f"Performed retrieval for {len(class_context_examplars)} requests.")
@@ -132,7 +147,7 @@ def feedback_generation_prompt(
     teacher_model: dict[str, str],
     feedback_retrieval: Optional[dict],
     class_context_retrieval: Optional[dict],
-    essay_context: list[EssayContext],
+    essay_context_index: EssayContextIndex,
     feedback_request: list[FeedbackRequest],
     tracking_client: TrackingClient,
     config: FeedbackGenerationPromptConfig) -> list[FeedbackRequest]:
@@ -149,15 +164,21 @@ def feedback_generation_prompt(
         feedback_retrieval = {req.request_id: [] for req in feedback_request}
     if class_context_retrieval is None:
         class_context_retrieval = {req.request_id: [] for req in feedback_request}
-    for request in feedback_request:
-        essay_context_input = [{"document_name": context.name, "document_content": context.content} for context in essay_context if context.assignment_id == request.assignment_id]
-        request.llm_prompt = prompt_director.build_prompt(
-            feedback_request=request.model_dump(include=["instruction", "text_selection"]),
-            teacher_model=teacher_model[request.user_id],
-            feedback_retrieval_results=feedback_retrieval.get(request.request_id, []),
-            class_context_retrieval_results=class_context_retrieval.get(request.request_id, []),
-            essay_context=essay_context_input
-        )
+    essay_context_input = {assignment_id: essay_context_index.prompt_inputs(assignment_id) for assignment_id in essay_context_index.documents}
+    prompts = prompt_director.build_prompts(
+        feedback_requests=[request.model_dump(include=["request_id", "user_id", "assignment_id", "instruction", "text_selection"]) for request in feedback_request],
+        teacher_models=teacher_model,
+        feedback_retrieval_results=feedback_retrieval,
+        class_context_retrieval_results=class_context_retrieval,
+        essay_context=essay_context_input
+    )
+    for request, prompt in zip(feedback_request, prompts):
+        request.llm_prompt = prompt
+    if len(prompt_director.prefix_report) > 0:
+        tracking_client.log_artifact(data=prompt_director.prefix_report, filename="shared_prefixes.json", mode="overwrite", asset_key="feedback_generation_prompt")
+        mean_prefix_tokens = sum(group["shared_prefix_tokens"] for group in prompt_director.prefix_report) / len(prompt_director.prefix_report)
+        tracking_client.log_metric(context.asset_key, "mean_shared_prefix_tokens", mean_prefix_tokens)
+        logger.info(f"Requests share a prompt prefix of {mean_prefix_tokens:.0f} tokens on average across {len(prompt_director.prefix_report)} groups")
     logger.debug(feedback_request[0].llm_prompt)
     return feedback_request
 
@@ -170,8 +191,24 @@ def llm_feedback(
     tracking_client: TrackingClient) -> list[FeedbackRequest]:
     """Generate feedback using LLM and write to the bucket."""
     logger.debug(feedback_generation_prompt[0].llm_prompt)
-    for request in feedback_generation_prompt:
-        request.llm_response = llm.call(request.llm_prompt, mock_response=MockLLMResponse.FEEDBACK.name)
+    if llm.batch_mode:
+        # batch custom ids must be strings
+        batch_responses = llm.call_batch({str(request.request_id): request.llm_prompt for request in feedback_generation_prompt}, mock_response=MockLLMResponse.FEEDBACK.name)
+        responses = [batch_responses[str(request.request_id)] for request in feedback_generation_prompt]
+    else:
+        try:
+            responses = llm.call_many([request.llm_prompt for request in feedback_generation_prompt], mock_response=MockLLMResponse.FEEDBACK.name)
+        except PartialResponsesError as error:
+            # keep the responses that were already paid for before failing the step
+            partial = [
+                {**request.model_dump(by_alias=True), "llmResponse": response}
+                for request, response in zip(feedback_generation_prompt, error.responses) if response is not None
+            ]
+            tracking_client.log_artifact(data=partial, filename="feedback_generation_partial.json", mode="overwrite", asset_key="llm_feedback")
+            raise
+    for request, response in zip(feedback_generation_prompt, responses):
+        request.llm_response = response
+        request.llm_model = llm.served_model(request.llm_prompt)
         request.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     data = [request.model_dump(by_alias=True) for request in feedback_generation_prompt]
     assert context.run_id == tracking_client._run_id
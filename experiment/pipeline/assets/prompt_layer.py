@@ -10,7 +10,7 @@ from experiment.prompt import (
     TeacherModelOutputFormats, 
     TeacherModelUpdateInstructionStyles
     )
-import random
+from experiment.utils import PACKING_STRATEGIES, group_by, reservoir_sample_by
 from functools import partial
 
 
@@ -35,6 +35,7 @@ class TeacherModelUpdateConfig(Config):
     max_examples: int = 3
     instruction_style: str = TeacherModelUpdateInstructionStyles.DESCRIBE.name
     max_feedback_example_tokens: int = 1500
+    packing_strategy: str = Field(default="greedy", examples=PACKING_STRATEGIES)
     
 
 @asset(group_name=GROUP_NAME)
@@ -42,17 +43,20 @@ def teacher_model_base(context: AssetExecutionContext, experiment_init, teacher_
     tracking_client.log_asset_config(config, context.asset_key)
     prompt_director = TeacherModelBaseDirector(**{**config.model_dump(), "llm": partial(llm.call, mock_response=MockLLMResponse.CLASS_DOCUMENT_SUMMARY.name)})
 
-    artifacts = []
+    class_documents_by_teacher = group_by(class_documents, key=lambda doc: doc.user_id)
+    prompts = []
     for teacher in teacher_profile:
-        class_context_for_teacher = [doc for doc in class_documents if doc.user_id == teacher.user_id]
-        class_context_for_teacher = [{"document_name": doc.name, "document_content": doc.content} for doc in class_context_for_teacher]
+        class_context_for_teacher = [{"document_name": doc.name, "document_content": doc.content} for doc in class_documents_by_teacher.get(teacher.user_id, [])]
         teacher_onboarding = [onboarding_response.model_dump() for onboarding_response in teacher.onboarding_responses]
-        prompt = prompt_director.build_prompt(
+        prompts.append(prompt_director.build_prompt(
             class_context=class_context_for_teacher, 
             onboarding=teacher_onboarding
-            )
-        teacher.teacher_model = llm.call(prompt, mock_response=MockLLMResponse.TEACHER_MODEL.name)
+            ))
+    teacher_models = llm.call_many(prompts, mock_response=MockLLMResponse.TEACHER_MODEL.name)
 
+    artifacts = []
+    for teacher, prompt, teacher_model in zip(teacher_profile, prompts, teacher_models):
+        teacher.teacher_model = teacher_model
         artifacts.append({**teacher.model_dump(by_alias=True), "prompt": prompt})
     tracking_client.log_artifact(data=artifacts, filename="teacher_model_base.json", asset_key="teacher_model_base")
     logger.info(f"Generated base teacher models for {len(teacher_profile)} teachers.")
@@ -66,22 +70,19 @@ def teacher_model_update_prompt(context: AssetExecutionContext, teacher_model_ba
     
     update_prompts = {}
     update_count = 0
-    prompt_director = TeacherModelUpdateDirector(**config.model_dump(include=["version", "instruction_style", "max_feedback_example_tokens"]))
+    prompt_director = TeacherModelUpdateDirector(**config.model_dump(include=["version", "instruction_style", "max_feedback_example_tokens", "packing_strategy"]))
+    # one pass over all feedback, keeping a uniform sample of at most max_examples per teacher
+    feedback_by_teacher = reservoir_sample_by(teacher_feedback, key=lambda fb: fb.user_id, k=config.max_examples) if config.enabled else {}
     for teacher in teacher_model_base:
         if not config.enabled:
             update_prompts[teacher.user_id] = None
             continue
-        feedback = [fb for fb in teacher_feedback if fb.user_id == teacher.user_id]
+        feedback = feedback_by_teacher.get(teacher.user_id, [])
         if len(feedback) == 0:
             # there is no feedback, and thus no update required
             update_prompts[teacher.user_id] = None
         else:
             update_count += 1
-            if len(feedback) > config.max_examples:
-                # shuffle the feedback to make it random
-                random.shuffle(feedback)
-                feedback = feedback[:config.max_examples]
-            
             feedback = [{'highlighted_text': fb.highlighted_text, 'feedback_text': fb.feedback_text} for fb in feedback]
 
             update_prompts[teacher.user_id] = prompt_director.build_prompt(
@@ -101,12 +102,13 @@ def teacher_model(teacher_model_base: list[Teacher], teacher_model_update_prompt
     """
     teacher_models = {}
     artifacts = []
-    update_count = 0
+    to_update = [teacher for teacher in teacher_model_base if teacher_model_update_prompt[teacher.user_id] is not None]
+    updated_models = llm.call_many([teacher_model_update_prompt[teacher.user_id] for teacher in to_update], mock_response=MockLLMResponse.TEACHER_MODEL.name)
+    for teacher, updated_model in zip(to_update, updated_models):
+        teacher.teacher_model = updated_model
+    update_count = len(to_update)
     for teacher in teacher_model_base:
         prompt = teacher_model_update_prompt[teacher.user_id]
-        if prompt is not None:
-            update_count += 1
-            teacher.teacher_model = llm.call(prompt, mock_response=MockLLMResponse.TEACHER_MODEL.name)
         teacher_models[teacher.user_id] = teacher.teacher_model
         artifacts.append({**teacher.model_dump(by_alias=True), "update_prompt": prompt})
     tracking_client.log_artifact(data=artifacts, filename="teacher_model_update.json", asset_key="teacher_model_update")
@@ -3,7 +3,7 @@ from experiment.pipeline.resources import LLM, FileStoreBucket, EmbeddingModel,
 from experiment.pipeline.models import Feedback, FeedbackRequest
 from langchain.prompts import PromptTemplate
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.metrics.pairwise import paired_cosine_distances
 import numpy as np
 
 
@@ -38,7 +38,10 @@ FEEDBACK:
     for request in feedback_request:
         vars = {"essay": request.text_selection, "instruction": request.instruction}
         request.llm_prompt = prompt_template.format(**vars)
-        request.llm_response = llm.call_baseline_feedback(request.llm_prompt)
+    responses = llm.call_baseline_feedback_many([request.llm_prompt for request in feedback_request])
+    for request, response in zip(feedback_request, responses):
+        request.llm_response = response
+        request.llm_model = llm.served_model(request.llm_prompt)
     bucket.write_json(data=[fr.model_dump(by_alias=True) for fr in feedback_request], source="default", data_key="baseline_feedback", mode="overwrite")
     return feedback_request
 
@@ -56,7 +59,6 @@ def sim_feedback_evaluation(
         logger.warning("No ground truth feedback provided, skipping evaluation")
         return
 
-    scores = {}
     if len(sim_feedback_baseline) != len(sim_ground_truth_feedback):
         logger.error("Baseline feedback and ground truth feedback length mismatch")
         raise ValueError("Baseline feedback and ground truth feedback length mismatch")
@@ -77,26 +79,22 @@ def sim_feedback_evaluation(
     feedback_df = truth_feedback_df.merge(llm_feedback_df, left_on="feedback_id", right_on="request_id")
     feedback_df = feedback_df.merge(baseline_feedback_df, left_on="request_id", right_on="request_id")
 
-    # compute cosine similarity between ground truth and predictions
-    for idx, row in feedback_df.iterrows():
-        ground_truth = row["ground_truth"]
-        feedback_prediction = row["feedback_prediction"]
-        baseline_prediction = row["baseline_prediction"]
-
-        ground_truth_embedding = [embedding_model.embed(ground_truth)]
-        feedback_prediction_embedding = [embedding_model.embed(feedback_prediction)]
-        baseline_prediction_embedding = [embedding_model.embed(baseline_prediction)]
-
-        feedback_prediction_score = cosine_similarity(ground_truth_embedding, feedback_prediction_embedding)[0][0]
-        baseline_prediction_score = cosine_similarity(ground_truth_embedding, baseline_prediction_embedding)[0][0]
-
-        scores[row["request_id"]] = {
-            "feedback_prediction_score": feedback_prediction_score,
-            "baseline_prediction_score": baseline_prediction_score,
-        }
-    
-    feedback_df["feedback_prediction_score"] = feedback_df["request_id"].apply(lambda x: scores[x]["feedback_prediction_score"])
-    feedback_df["baseline_prediction_score"] = feedback_df["request_id"].apply(lambda x: scores[x]["baseline_prediction_score"])
+    # compute cosine similarity between ground truth and predictions, embedding every text in one call
+    num_rows = feedback_df.shape[0]
+    if num_rows == 0:
+        # nothing matched the ground truth: keep empty score columns rather than embedding nothing
+        logger.warning("No predictions matched the ground truth feedback")
+        feedback_df["feedback_prediction_score"] = pd.Series(dtype=float)
+        feedback_df["baseline_prediction_score"] = pd.Series(dtype=float)
+    else:
+        texts = feedback_df["ground_truth"].tolist() + feedback_df["feedback_prediction"].tolist() + feedback_df["baseline_prediction"].tolist()
+        embeddings = np.asarray(embedding_model.embed(texts))
+        ground_truth_embeddings = embeddings[:num_rows]
+        feedback_prediction_embeddings = embeddings[num_rows:2 * num_rows]
+        baseline_prediction_embeddings = embeddings[2 * num_rows:]
+
+        feedback_df["feedback_prediction_score"] = 1 - paired_cosine_distances(ground_truth_embeddings, feedback_prediction_embeddings)
+        feedback_df["baseline_prediction_score"] = 1 - paired_cosine_distances(ground_truth_embeddings, baseline_prediction_embeddings)
 
     tracking_client.log_artifact(data=feedback_df, filename="results.csv", asset_key="feedback_evaluation")
 
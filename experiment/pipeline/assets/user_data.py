@@ -1,7 +1,7 @@
 from dagster import asset, get_dagster_logger, Config
 from pydantic import Field
 from experiment.pipeline.resources import FileStoreBucket, DocumentParser
-from experiment.pipeline.models import Feedback, ClassDocument, EssayContext, Teacher
+from experiment.pipeline.models import Feedback, ClassDocument, EssayContext, EssayContextIndex, Teacher
 import re
 
 GROUP_NAME = "user_data"
@@ -53,6 +53,14 @@ def essay_context(experiment_init, bucket: FileStoreBucket, document_parser: Doc
     return context
 
 
+@asset(group_name=GROUP_NAME)
+def essay_context_index(essay_context: list[EssayContext]) -> EssayContextIndex:
+    """Essay context grouped by assignment_id, shared by every asset that looks it up per request."""
+    index = EssayContextIndex(essay_context)
+    logger.info(f"Indexed {len(essay_context)} essay context documents for {len(index)} assignments")
+    return index
+
+
 @asset(group_name=GROUP_NAME)
 def teacher_profile(experiment_init, bucket: FileStoreBucket, config: UserDataConfig) -> list[Teacher]:
     # ✅ COMPLETE
@@ -47,6 +47,8 @@ class FeedbackRequest(BaseModel):
     search_query_embedding: Iterable | None = None
     llm_prompt: str | None = None
     llm_response: str | None = None
+    # model that produced llm_response, which differs from the configured one when a fallback served it
+    llm_model: str | None = None
     timestamp: str | None = None
     
     class Config:
@@ -79,6 +81,41 @@ class EssayContext(BaseDocument):
         populate_by_name=True
         from_attributes=True
 
+class EssayContextIndex:
+    """
+    Essay context documents grouped by assignment_id, built once per run.
+
+    Also holds, per assignment, the document inputs the prompt directors take and the
+    "ESSAY CONTEXT" text the embedding preprocessor prepends, so consumers look them up
+    instead of scanning every document for each request.
+    """
+    def __init__(self, documents: Iterable[EssayContext]):
+        self.documents: dict[int, list[EssayContext]] = {}
+        for document in documents:
+            self.documents.setdefault(document.assignment_id, []).append(document)
+        self._prompt_inputs = {
+            assignment_id: [{"document_name": document.name, "document_content": document.content} for document in documents]
+            for assignment_id, documents in self.documents.items()
+        }
+        self._context_text = {
+            assignment_id: "ESSAY CONTEXT:\n" + "".join(f"{document.content}\n\n" for document in documents)
+            for assignment_id, documents in self.documents.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def get(self, assignment_id: int) -> list[EssayContext]:
+        return self.documents.get(assignment_id, [])
+
+    def prompt_inputs(self, assignment_id: int) -> list[dict]:
+        """Documents of the assignment as {"document_name", "document_content"} dicts."""
+        return self._prompt_inputs.get(assignment_id, [])
+
+    def context_text(self, assignment_id: int) -> str | None:
+        """The assignment's documents as one "ESSAY CONTEXT" block, or None when it has none."""
+        return self._context_text.get(assignment_id)
+
 class ClassDocument(BaseDocument):
     content: str | None = None
     chunks: list[str] | None = None
@@ -1,7 +1,7 @@
 from ._embedding_model import EmbeddingModel
 from ._file_store_bucket import FileStoreBucket
 from ._vector_store import VectorStore
-from ._llm import LLM, MockLLMResponse
+from ._llm import LLM, MockLLMResponse, PartialResponsesError
 from ._embedding_preprocess import EmbeddingPreprocessor
 from ._mlflow import TrackingClient, delete_artifacts
 from ._document_parser import DocumentParser
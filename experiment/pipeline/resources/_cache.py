@@ -0,0 +1,112 @@
+from dagster import get_dagster_logger
+from typing import Optional
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = get_dagster_logger()
+
+
+def content_key(*parts) -> str:
+    """Content address for a cache entry: a sha256 over the given parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Size-bounded key/value cache persisted in a SQLite file.
+
+    Entries are evicted least-recently-used first once the cache holds more than max_entries, down
+    to EVICT_TO of max_entries so that the next writes do not evict again. The entry count is only
+    queried when a running estimate (every write counted as new) passes max_entries, so writes stay
+    cheap on a large cache. Safe to share between threads, and between processes through SQLite's own locking.
+    """
+
+    # SQLite caps the number of bound parameters per statement
+    _MAX_PARAMS = 500
+    EVICT_TO = 0.9
+
+    def __init__(self, path: str, max_entries: int) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, last_access REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._connection.commit()
+        (self._estimated_count,) = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        """Return the cached values for the keys that are present, refreshing their recency."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), self._MAX_PARAMS):
+                batch = unique_keys[start:start + self._MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(f"SELECT key, value FROM entries WHERE key IN ({placeholders})", batch).fetchall()
+                found.update(rows)
+                if rows:
+                    self._connection.execute(
+                        f"UPDATE entries SET last_access = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [time.time(), *[key for key, _ in rows]]
+                    )
+            self._connection.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def set(self, key: str, value: bytes) -> None:
+        self.set_many({key: value})
+
+    def set_many(self, items: dict[str, bytes]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, last_access) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items.items()]
+            )
+            # replacements and other processes' writes make this an estimate, corrected by the COUNT below
+            self._estimated_count += len(items)
+            if self._estimated_count > self.max_entries:
+                (count,) = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()
+                self._estimated_count = count
+                if count > self.max_entries:
+                    target = int(self.max_entries * self.EVICT_TO)
+                    self._connection.execute(
+                        "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                        (count - target,)
+                    )
+                    self._estimated_count = target
+                    logger.debug(f"Evicted {count - target} entries from {self.path}")
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
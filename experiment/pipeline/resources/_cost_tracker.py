@@ -0,0 +1,46 @@
+from dagster import get_dagster_logger
+from typing import Optional
+from uuid import uuid4
+import threading
+import pandas as pd
+from ._mlflow import TrackingClient
+
+
+logger = get_dagster_logger()
+
+
+class CostEstimateRecorder:
+    """
+    Collects cost-estimation rows in memory and writes them as one parquet artifact per client.
+
+    Every checkpoint_every rows the file is rewritten with everything collected so far, so a crashed
+    run still leaves its estimates behind; flush() writes the final state.
+    """
+
+    ASSET_KEY = "llm/cost_estimations"
+
+    def __init__(self, tracking_client: TrackingClient, name: str, checkpoint_every: Optional[int] = 1000) -> None:
+        self.tracking_client = tracking_client
+        # unique per client, so concurrent steps of a run never write the same file
+        self.filename = f"{name}-{uuid4().hex}.parquet"
+        self.checkpoint_every = checkpoint_every
+        self._rows = []
+        self._unflushed = 0
+        self._lock = threading.Lock()
+
+    def add(self, row: dict) -> None:
+        with self._lock:
+            self._rows.append(row)
+            self._unflushed += 1
+            checkpoint = self.checkpoint_every is not None and self._unflushed >= self.checkpoint_every
+        if checkpoint:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._unflushed == 0:
+                return
+            data = pd.DataFrame(self._rows)
+            self._unflushed = 0
+            self.tracking_client.log_artifact(data=data, filename=self.filename, mode="overwrite", asset_key=self.ASSET_KEY)
+        logger.debug(f"Wrote {len(data)} cost estimates to {self.filename}")
@@ -1,21 +1,56 @@
 from dagster import ConfigurableResource, InitResourceContext, get_dagster_logger, Config, EnvVar, ResourceDependency
-from pydantic import Field
-import requests
-from typing import Union, Iterable 
+from pydantic import Field, PrivateAttr
+from typing import Union, Iterable, Optional
 from tokencost import calculate_prompt_cost, count_string_tokens
 import pandas as pd
 import os
 import boto3
 import json
 from ._mlflow import TrackingClient
-from datetime import datetime
+from ._cache import DiskCache, content_key
+from ._rate_limit import RateLimiter
+from ._resilience import RetryPolicy
+from ._cost_tracker import CostEstimateRecorder
+from ._provider import ProviderResource
+from concurrent.futures import ThreadPoolExecutor
+from experiment.utils import count_tokens, http_session
+import numpy as np
 
 
 logger = get_dagster_logger()
 
+# most inputs a provider accepts in one embedding request
+PROVIDER_MAX_BATCH_SIZE = {
+    "amazon.titan-embed-text-v2:0": 1,
+    "cohere.embed-english-v3": 96,
+}
+# what an embedded text is used for; models trained asymmetrically (Cohere) embed queries differently
+INPUT_TYPES = ["search_document", "search_query"]
+INPUT_TYPE_MODELS = {"cohere.embed-english-v3"}
+
 
 class EmbeddingModelClient:
-    def __init__(self, model_name, openai_api_key, cost_estimation_mode, dagster_run_id, tracking_client, aws_access_key_id=None, aws_secret_access_key=None, region_name=None):
+    def __init__(
+            self, 
+            model_name, 
+            openai_api_key, 
+            cost_estimation_mode, 
+            dagster_run_id, 
+            tracking_client, 
+            aws_access_key_id=None, 
+            aws_secret_access_key=None, 
+            region_name=None, 
+            cache: Optional[DiskCache] = None,
+            max_batch_size: int = 2048,
+            max_batch_tokens: int = 250_000,
+            max_concurrency: int = 1,
+            rate_limiter: Optional[RateLimiter] = None,
+            pool_size: int = 10,
+            connect_timeout: float = 10.0,
+            read_timeout: float = 60.0,
+            retry_policy: Optional[RetryPolicy] = None,
+            cost_checkpoint_every: Optional[int] = 1000
+            ):
         self.model_name = model_name
         self.openai_api_key = openai_api_key
         self.cost_estimation_mode = cost_estimation_mode
@@ -24,6 +59,15 @@ class EmbeddingModelClient:
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
         self.region_name = region_name
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.session = http_session(pool_size)
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.cost_recorder = CostEstimateRecorder(tracking_client, "embedding", cost_checkpoint_every) if cost_estimation_mode else None
         
         # If the user-chosed embedding model is from Bedrock, start a boto3 client session
         if self.model_name.startswith("amazon.titan-embed-text-v2") or self.model_name.startswith("cohere.embed"):
@@ -34,14 +78,32 @@ class EmbeddingModelClient:
                 region_name=self.region_name
             )
 
-    def embed(self, text: Union[str, list[str]],dimensions: int = 512, normalize: bool = True) -> Union[Iterable[float], list[Iterable[float]]]:
+    @property
+    def fingerprint(self) -> Optional[str]:
+        """Identifies the vectors this client produces, or None when they are mock vectors from cost estimation."""
+        if self.cost_estimation_mode:
+            return None
+        return self.model_name
+
+    def embed(self, text: Union[str, list[str]],dimensions: int = 512, normalize: bool = True, input_type: str = "search_document") -> Union[Iterable[float], list[Iterable[float]]]:
         """Embed text using the specified model.
         
-        Supports single and batch requests.
+        Supports single and batch requests. Lists are split into batches sized for the provider,
+        so callers should pass every text they need in one call.
 
         For a single text string, return a single embedding vector. For a list of text strings, 
         return a list of embedding vectors.
+
+        When the client has a cache, vectors are looked up by (model, dimensions, normalize, text hash)
+        and only the texts that miss are sent to the provider.
+
+        input_type is 'search_query' for retrieval queries and 'search_document' for indexed text. Only
+        models in INPUT_TYPE_MODELS embed them differently; the others ignore it.
         """
+        if input_type not in INPUT_TYPES:
+            raise ValueError(f"Invalid input type: {input_type}. Should be one of {INPUT_TYPES}")
+        if self.model_name not in INPUT_TYPE_MODELS:
+            input_type = "search_document"
         if self.cost_estimation_mode:
             if isinstance(text, str):
                 embedding_cost = calculate_prompt_cost(text, self.model_name)
@@ -60,15 +122,96 @@ class EmbeddingModelClient:
                 'total_tokens': int(tokens),
                 'mock_response': None,
                 }
-            self.tracking_client.log_artifact(data=add_row, filename=f"{datetime.now().isoformat()}.json", asset_key="llm/cost_estimations")
+            self.cost_recorder.add(add_row)
             if isinstance(text, str):
                 return [1, 2, 3]
             else:
                 return [[1, 2, 3] for _ in text]
 
+        texts = [text] if isinstance(text, str) else list(text)
+        if self.cache is None:
+            embeddings = self._embed_texts(texts, dimensions, normalize, input_type)
+        else:
+            keys = [self._cache_key(t, dimensions, normalize, input_type) for t in texts]
+            cached = self.cache.get_many(keys)
+            # only the distinct texts that are not cached go to the provider
+            missing = list(dict.fromkeys(t for t, key in zip(texts, keys) if key not in cached))
+            if len(missing) > 0:
+                new_embeddings = self._embed_texts(missing, dimensions, normalize, input_type)
+                new_entries = {
+                    self._cache_key(t, dimensions, normalize, input_type): np.asarray(embedding, dtype=np.float32).tobytes()
+                    for t, embedding in zip(missing, new_embeddings)
+                }
+                self.cache.set_many(new_entries)
+                cached.update(new_entries)
+            embeddings = [np.frombuffer(cached[key], dtype=np.float32).tolist() for key in keys]
+
+        if isinstance(text, str):
+            return embeddings[0]
+        return embeddings
+
+    def _cache_key(self, text: str, dimensions: int, normalize: bool, input_type: str) -> str:
+        # document keys predate input types, so only query vectors get the extra part
+        if input_type == "search_document":
+            return content_key(self.model_name, dimensions, normalize, text)
+        return content_key(self.model_name, dimensions, normalize, input_type, text)
+
+    def _embed_texts(self, texts: list[str], dimensions: int, normalize: bool, input_type: str = "search_document") -> list[Iterable[float]]:
+        """Split texts into provider-sized batches, embed them, and return one embedding per text, in order.
+
+        With max_concurrency above 1, batches are sent through a bounded thread pool; the rate limiter
+        keeps the in-flight requests within the provider's requests and tokens per minute.
+        """
+        batches = self._batches(texts)
+
+        def embed_batch(batch: tuple[list[str], int]) -> list[Iterable[float]]:
+            batch_texts, batch_tokens = batch
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(batch_tokens)
+            return self.retry_policy.call(f"{self.provider}/embeddings", lambda: self._embed_batch(batch_texts, dimensions, normalize, input_type))
+
+        if self.max_concurrency <= 1 or len(batches) <= 1:
+            results = [embed_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                # map yields in submission order, so embeddings line up with the input texts
+                results = list(executor.map(embed_batch, batches))
+        return [embedding for result in results for embedding in result]
+
+    def _batches(self, texts: list[str]) -> list[tuple[list[str], int]]:
+        """Group consecutive texts into (texts, token count) batches bounded by item count and by total token count."""
+        max_batch_size = min(self.max_batch_size, PROVIDER_MAX_BATCH_SIZE.get(self.model_name, self.max_batch_size))
+        needs_tokens = max_batch_size > 1 or (self.rate_limiter is not None and self.rate_limiter.tokens_per_minute)
+        token_counts = count_tokens(texts) if needs_tokens else [0] * len(texts)
+        if max_batch_size <= 1:
+            return [([text], tokens) for text, tokens in zip(texts, token_counts)]
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for text, tokens in zip(texts, token_counts):
+            if len(batch) > 0 and (len(batch) >= max_batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append((batch, batch_tokens))
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if len(batch) > 0:
+            batches.append((batch, batch_tokens))
+        return batches
+
+    @property
+    def provider(self) -> str:
+        if self.model_name.startswith("amazon.titan-embed-text-v2") or self.model_name.startswith("cohere.embed"):
+            return "bedrock"
+        return "openai"
+
+    def _embed_batch(self, texts: list[str], dimensions: int, normalize: bool, input_type: str = "search_document") -> list[Iterable[float]]:
+        """Embed one batch with a single provider request."""
         # ❌ TOREVIEW
         # if user selected amazon titan v2 as the embedding model
         if self.model_name == "amazon.titan-embed-text-v2:0":
+            # titan has no batch input, batches are always a single text
+            text = texts[0]
             data = {"inputText": text,
                     "dimensions": dimensions,
                     "normalize": normalize}
@@ -79,7 +222,7 @@ class EmbeddingModelClient:
                 contentType="application/json"
             )
             result = json.loads(response["body"].read())
-            embeddings = result.get("embedding")
+            embeddings = [result.get("embedding")]
             
             logger.info(f"Embedding '{text}' using '{self.model_name}' with dimensions {dimensions} and normalize {normalize}")
             return embeddings
@@ -87,7 +230,8 @@ class EmbeddingModelClient:
 
         elif self.model_name == "cohere.embed-english-v3":
             data = {
-                "inputText": text
+                "texts": texts,
+                "input_type": input_type
             }
             response = self.client.invoke_model(
                 body=json.dumps(data),
@@ -96,19 +240,15 @@ class EmbeddingModelClient:
                 contentType="application/json"
             )
             result = json.loads(response["body"].read())
-            embeddings = result.get("embedding")
+            embeddings = result.get("embeddings")
             
             return embeddings
             
-        else: # for everything else, let's use OpenAI's embedding model
+        # for everything else, let's use OpenAI's embedding model
         # if self.model_name.startswith('text-embedding') or self.model_name.startswith('openai'):
-            api_key = self.openai_api_key
-            endpoint = 'https://api.openai.com/v1/embeddings'
-            request_params = {'model': self.model_name}
-            if isinstance(text, str):
-                response_formatter = lambda response: response['data'][0]['embedding']
-            elif isinstance(text, list):
-                response_formatter = lambda response: [result['embedding'] for result in response['data']]
+        api_key = self.openai_api_key
+        endpoint = 'https://api.openai.com/v1/embeddings'
+        request_params = {'model': self.model_name}
         # placeholder for other llm implementation later
         # elif self.model_name.startswith('mpnet-base'):
         #     self.api_key = config.other_llm_api_key
@@ -132,20 +272,33 @@ class EmbeddingModelClient:
                    'Authorization': f'Bearer {api_key}'}
                    
         data = {'model': self.model_name,
-                'input': text}
+                'input': texts}
         
         data.update(request_params)
     
-        response = requests.post(endpoint, headers=headers, json=data)
+        response = self.session.post(endpoint, headers=headers, json=data, timeout=self.timeout)
         response.raise_for_status()
         result = response.json()
         
-        embeddings = response_formatter(result)
+        embeddings = [item['embedding'] for item in sorted(result['data'], key=lambda item: item['index'])]
         
         return embeddings
 
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the embedding cache for this client."""
+        if self.cache is None:
+            return {}
+        return self.cache.stats()
+
+    def close(self) -> None:
+        if self.cost_recorder is not None:
+            self.cost_recorder.flush()
+        if self.cache is not None:
+            logger.info(f"Embedding cache stats for '{self.model_name}': {self.cache.stats()}")
+            self.cache.close()
 
-class EmbeddingModel(ConfigurableResource):
+
+class EmbeddingModel(ProviderResource):
     model_name: str = Field(default="text-embedding-ada-002")
     openai_api_key: str = EnvVar("OPENAI_API_KEY")
     cost_estimation_mode: bool = False
@@ -153,6 +306,20 @@ class EmbeddingModel(ConfigurableResource):
     aws_secret_access_key: str = EnvVar("AWS_SECRET_ACCESS_KEY")
     region_name: str = 'us-east-1'
     tracking_client: ResourceDependency[TrackingClient]
+    # persistent embedding cache shared by every run on this machine
+    cache_enabled: bool = True
+    cache_path: str = ".cache/embeddings.sqlite"
+    cache_max_entries: int = 1_000_000
+    # upper bounds per embedding request, further capped by what the provider accepts
+    max_batch_size: int = 2048
+    max_batch_tokens: int = 250_000
+    # batches in flight at once, throttled to the provider's quota (None leaves a quota unenforced)
+    max_concurrency: int = 4
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    # cost estimates are written to one parquet file per step, rewritten every this many calls (None: only at teardown)
+    cost_checkpoint_every: Optional[int] = 1000
+    _client: Optional[EmbeddingModelClient] = PrivateAttr(default=None)
     #placeholder for implementing additional models
         # other_llm_api_key: str = Field(
         # default=EnvVar("OTHER_LLM_API_KEY"),
@@ -162,11 +329,25 @@ class EmbeddingModel(ConfigurableResource):
         #obtain run time model_name based on user configuration
         modelName = context.resource_config.get("model_name",self.model_name)
 
-        return EmbeddingModelClient(model_name=modelName,  
+        self._client = EmbeddingModelClient(model_name=modelName,  
                                     openai_api_key=self.openai_api_key, 
                                     cost_estimation_mode=self.cost_estimation_mode,
                                     dagster_run_id=context.run_id, 
                                     aws_access_key_id=self.aws_access_key_id,
                                     aws_secret_access_key=self.aws_secret_access_key,
                                     region_name=self.region_name,
-                                    tracking_client=self.tracking_client)
+                                    tracking_client=self.tracking_client,
+                                    # cost estimation makes no API calls, so there is nothing to cache
+                                    cache=DiskCache(self.cache_path, self.cache_max_entries) if self.cache_enabled and not self.cost_estimation_mode else None,
+                                    max_batch_size=self.max_batch_size,
+                                    max_batch_tokens=self.max_batch_tokens,
+                                    max_concurrency=self.max_concurrency,
+                                    rate_limiter=RateLimiter(self.requests_per_minute, self.tokens_per_minute),
+                                    **self.connection_kwargs(),
+                                    retry_policy=self.retry_policy(),
+                                    cost_checkpoint_every=self.cost_checkpoint_every)
+        return self._client
+
+    def teardown_after_execution(self, context: InitResourceContext) -> None:
+        if self._client is not None:
+            self._client.close()
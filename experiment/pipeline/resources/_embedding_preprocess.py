@@ -1,5 +1,5 @@
 from dagster import ConfigurableResource, get_dagster_logger
-from experiment.pipeline.models import Feedback, EssayContext, FeedbackRequest
+from experiment.pipeline.models import Feedback, EssayContextIndex, FeedbackRequest
 
 logger = get_dagster_logger()
 
@@ -12,7 +12,7 @@ class EmbeddingPreprocessor(ConfigurableResource):
     # SEARCH PARAMS
     include_teacher_instruction: bool = False
 
-    def preprocess_feedback_index(self, feedback: list[Feedback], essay_context: list[EssayContext]) -> list[Feedback]:
+    def preprocess_feedback_index(self, feedback: list[Feedback], essay_context: EssayContextIndex) -> list[Feedback]:
         """
         Preprocess feedback data for indexing in the vector store
         """
@@ -25,13 +25,10 @@ class EmbeddingPreprocessor(ConfigurableResource):
             
             # ======= include_essay_context =======
             if self.include_essay_context:
-                assignment_essay_context = [essay_context_doc for essay_context_doc in essay_context if essay_context_doc.assignment_id == fb.assignment_id]
-                if len(assignment_essay_context) == 0:
+                context = essay_context.context_text(fb.assignment_id)
+                if context is None:
                     logger.warning(f"No essay context found for assignment_id: {fb.assignment_id}")
                     continue
-                context = "ESSAY CONTEXT:\n"
-                for essay_context_doc in assignment_essay_context:
-                    context += f"{essay_context_doc.content}\n\n"
                 # prepend essay context to each essay text
                 index_text = [context + essay_text for essay_text in index_text]
 
@@ -44,7 +41,7 @@ class EmbeddingPreprocessor(ConfigurableResource):
 
         return feedback
 
-    def preprocess_feedback_search(self, feedback_request: list[FeedbackRequest], essay_context: list[EssayContext]) -> list[FeedbackRequest]:
+    def preprocess_feedback_search(self, feedback_request: list[FeedbackRequest], essay_context: EssayContextIndex) -> list[FeedbackRequest]:
         """
         Preprocess feedback data for searching in the vector store
         """
@@ -61,13 +58,10 @@ class EmbeddingPreprocessor(ConfigurableResource):
             
             # ======= include_essay_context =======
             if self.include_essay_context:
-                assignment_essay_context = [essay_context_doc for essay_context_doc in essay_context if essay_context_doc.assignment_id == request.assignment_id]
-                if len(assignment_essay_context) == 0:
+                context = essay_context.context_text(request.assignment_id)
+                if context is None:
                     logger.warning(f"No essay context found for assignment_id: {request.assignment_id}")
                     continue
-                context = "ESSAY CONTEXT:\n"
-                for essay_context_doc in assignment_essay_context:
-                    context += f"{essay_context_doc.content}\n\n"
                 search_query_text = context + search_query_text
             request.search_query_text = search_query_text
 
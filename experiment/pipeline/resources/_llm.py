@@ -1,20 +1,43 @@
 import json
-from typing import Optional
+from typing import Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from dagster import ConfigurableResource, get_dagster_logger, Config, EnvVar, InitResourceContext, ResourceDependency
-from pydantic import Field
+from pydantic import Field, PrivateAttr
 import requests
 import google.generativeai as genai
 from google.generativeai import configure
 import os
-from experiment.utils import num_tokens_for_llm
+from experiment.utils import num_tokens_for_llm, http_session, iter_chat_stream
 from tokencost import calculate_prompt_cost, calculate_completion_cost, count_string_tokens
 import pandas as pd
 from enum import Enum
-from datetime import datetime
+from uuid import uuid4
 from ._mlflow import TrackingClient
+from ._cache import DiskCache, content_key
+from ._resilience import RetryPolicy
+from ._cost_tracker import CostEstimateRecorder
+from ._router import MODEL_PROVIDERS, model_router
+from ._provider import ProviderResource
+import threading
+import time
 
 logger = get_dagster_logger()
 
+# when LLMClient.call may answer from the response cache
+CACHE_POLICIES = ["always", "deterministic", "never"]
+
+
+class PartialResponsesError(RuntimeError):
+    """Raised by call_many when some prompts failed, carrying the responses that did complete."""
+
+    def __init__(self, responses: list[Optional[str]], errors: dict[int, Exception]) -> None:
+        first = min(errors)
+        super().__init__(f"{len(errors)} of {len(responses)} LLM calls failed, e.g. prompt {first}: {errors[first]!r}")
+        # in prompt order, None where the call failed
+        self.responses = responses
+        # prompt position -> exception
+        self.errors = errors
+
 
 class LLMClient:
     def __init__(
@@ -27,7 +50,23 @@ class LLMClient:
             gemini_api_key, 
             cost_estimation_mode, 
             tracking_client: TrackingClient,
-            dagster_run_id: Optional[str] = None
+            dagster_run_id: Optional[str] = None,
+            pool_size: int = 10,
+            connect_timeout: float = 10.0,
+            read_timeout: float = 120.0,
+            max_concurrency: int = 1,
+            model_concurrency: Optional[dict[str, int]] = None,
+            cache: Optional[DiskCache] = None,
+            cache_policy: str = "never",
+            batch_mode: bool = False,
+            batch_api_base: str = "https://api.openai.com/v1",
+            batch_poll_interval: float = 30.0,
+            batch_timeout: float = 24 * 3600,
+            retry_policy: Optional[RetryPolicy] = None,
+            fallback_models: Optional[list[str]] = None,
+            hedge_after: Optional[float] = None,
+            max_error_rate: float = 0.2,
+            cost_checkpoint_every: Optional[int] = 1000
             ):
         self.model_name = model_name
         self.max_tokens = max_tokens
@@ -38,6 +77,41 @@ class LLMClient:
         self.cost_estimation_mode = cost_estimation_mode
         self.tracking_client = tracking_client
         self.dagster_run_id_ = dagster_run_id
+        self.session = http_session(pool_size)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency or {}
+        if cache_policy not in CACHE_POLICIES:
+            raise ValueError(f"Cache policy must be one of {CACHE_POLICIES}, got '{cache_policy}'")
+        self.cache = cache
+        self.cache_policy = cache_policy
+        self.dollars_saved = 0.0
+        self._stats_lock = threading.Lock()
+        self.batch_mode = batch_mode
+        self.batch_api_base = batch_api_base.rstrip("/")
+        self.batch_poll_interval = batch_poll_interval
+        self.batch_timeout = batch_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.fallback_models = fallback_models or []
+        self.hedge_after = hedge_after
+        self.max_error_rate = max_error_rate
+        self.router = model_router()
+        # provider registry: how each provider in MODEL_PROVIDERS is called
+        self.providers = {
+            "openai": self._call_gpt,
+            "gemini": self._call_gemini,
+        }
+        # created up front, so concurrent call_many workers share one pool
+        self._hedge_pool = ThreadPoolExecutor(max_workers=2 * max(self.max_concurrency, 1)) if hedge_after is not None else None
+        self._served_by: dict[str, str] = {}
+        # unique per client, so concurrent steps of a run never write the same file
+        self._cache_stats_filename = f"llm-{uuid4().hex}.json"
+        self._gemini_models: dict[str, genai.GenerativeModel] = {}
+        self._gemini_lock = threading.Lock()
+        self.cost_recorder = CostEstimateRecorder(tracking_client, "llm", cost_checkpoint_every) if cost_estimation_mode else None
+        for name in self.fallback_models:
+            if name not in MODEL_PROVIDERS:
+                raise ValueError(f"Fallback model '{name}' is not yet supported")
 
     def call(self, prompt: str, mock_response: Optional[str] = None, model_name: Optional[str] = None):
         if model_name is None:
@@ -62,17 +136,302 @@ class LLMClient:
                 'total_tokens': int(total_tokens),
                 'mock_response': mock_response
                 }
-            self.tracking_client.log_artifact(data=add_row, filename=f"{datetime.now().isoformat()}.json", asset_key="llm/cost_estimations")
+            self.cost_recorder.add(add_row)
+            self._record_served(prompt, model_name)
             return MockLLMResponse[mock_response].value
 
-        if model_name in ['gpt-3.5-turbo', 'gpt-4', 'gpt-4o', 'gpt-4-turbo']:
-            return self._call_gpt(prompt, model_name)
-        elif model_name in ['gemini-1.5-flash', 'gemini-1.5-pro']:
-            configure(api_key=self.gemini_api_key)
-            return self._call_gemini(prompt, model_name)
+        if not self._use_cache():
+            response, served_by = self._call_routed(prompt, model_name)
+            self._record_served(prompt, served_by)
+            return response
+        cached = self._cache_lookup({prompt: prompt}, model_name)
+        if prompt in cached:
+            self._record_served(prompt, model_name)
+            return cached[prompt]
+        response, served_by = self._call_routed(prompt, model_name)
+        # a fallback model's response must not be replayed for the requested model
+        if served_by == model_name:
+            self._cache_store({prompt: prompt}, {prompt: response}, model_name)
+        self._record_served(prompt, served_by)
+        return response
+
+    def _record_served(self, prompt: str, model_name: str) -> None:
+        with self._stats_lock:
+            self._served_by[content_key(prompt)] = model_name
+
+    def served_model(self, prompt: str) -> Optional[str]:
+        """The model that produced the latest response to prompt, or None if it was not called in this client."""
+        with self._stats_lock:
+            return self._served_by.get(content_key(prompt))
+
+    def stream(self, prompt: str, mock_response: Optional[str] = None, model_name: Optional[str] = None) -> Iterator[str]:
+        """Like call, but yields the response text in pieces as the provider generates it.
+
+        Retries only cover opening the stream; cached and mock responses are yielded whole.
+        """
+        if model_name is None:
+            model_name = self.model_name
+        if self.cost_estimation_mode:
+            yield self.call(prompt, mock_response=mock_response, model_name=model_name)
+            return
+        if self._use_cache():
+            cached = self._cache_lookup({prompt: prompt}, model_name)
+            if prompt in cached:
+                yield cached[prompt]
+                return
+
+        provider = MODEL_PROVIDERS.get(model_name)
+        if provider == "openai":
+            chunks = self.retry_policy.call(f"{provider}/{model_name}", lambda: self._open_gpt_stream(prompt, model_name))
+        elif provider == "gemini":
+            chunks = self.retry_policy.call(f"{provider}/{model_name}", lambda: self._open_gemini_stream(prompt, model_name))
         else:
             raise ValueError(f"LLM model '{model_name}' is not yet supported")
-            
+
+        pieces = []
+        for chunk in chunks:
+            pieces.append(chunk)
+            yield chunk
+        if self._use_cache():
+            self._cache_store({prompt: prompt}, {prompt: "".join(pieces).strip()}, model_name)
+
+    def _open_gpt_stream(self, prompt: str, model_name: str) -> Iterator[str]:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.openai_api_key}'
+        }
+        data = {
+            'model': model_name,
+            'messages': [{"role": "user", "content": prompt}],
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+            'top_p': self.top_p,
+            'stream': True
+        }
+        response = self.session.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data, timeout=self.timeout, stream=True)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            response.close()
+            raise
+
+        def chunks() -> Iterator[str]:
+            with response:
+                yield from iter_chat_stream(response)
+        return chunks()
+
+    def _open_gemini_stream(self, prompt: str, model_name: str) -> Iterator[str]:
+        model = self._gemini_model(model_name)
+        response = model.generate_content(prompt, stream=True, request_options={"timeout": self.timeout[1]})
+        return (chunk.text for chunk in response if chunk.text)
+
+    def _cache_key(self, prompt: str, model_name: str) -> str:
+        return content_key(model_name, self.max_tokens, self.temperature, self.top_p, content_key(prompt))
+
+    def _cache_lookup(self, prompts: dict[str, str], model_name: str) -> dict[str, str]:
+        """Return the cached responses for the given {id: prompt}, keyed by id, and count the spend they avoid."""
+        keys = {request_id: self._cache_key(prompt, model_name) for request_id, prompt in prompts.items()}
+        found = self.cache.get_many(list(keys.values()))
+        responses = {request_id: found[key].decode() for request_id, key in keys.items() if key in found}
+        saved = sum(
+            calculate_prompt_cost(prompts[request_id], model_name) + calculate_completion_cost(response, model_name)
+            for request_id, response in responses.items()
+        )
+        with self._stats_lock:
+            self.dollars_saved += float(saved)
+        return responses
+
+    def _cache_store(self, prompts: dict[str, str], responses: dict[str, str], model_name: str) -> None:
+        self.cache.set_many({
+            self._cache_key(prompts[request_id], model_name): response.encode()
+            for request_id, response in responses.items()
+        })
+
+    def _use_cache(self) -> bool:
+        if self.cache is None or self.cache_policy == "never":
+            return False
+        if self.cache_policy == "deterministic":
+            return self.temperature == 0
+        return True
+
+    def _call_routed(self, prompt: str, model_name: str) -> tuple[str, str]:
+        """Call the requested model, or its fallbacks when configured, and return (response, model that served it).
+
+        Candidates are tried in the router's order: healthy models first, then by recent p95 latency. With
+        hedge_after set, a second request goes to the next candidate if the first has not answered in time,
+        and the first response to arrive wins.
+        """
+        candidates = [model_name]
+        if model_name == self.model_name:
+            candidates += [name for name in self.fallback_models if name != model_name]
+        if len(candidates) == 1:
+            return self._call_model(prompt, model_name), model_name
+        candidates = self.router.rank(candidates, self.max_error_rate)
+        if self.hedge_after is None:
+            return self._call_in_order(prompt, candidates)
+
+        first = self._hedge_pool.submit(self._call_in_order, prompt, candidates[:1])
+        done, _ = wait([first], timeout=self.hedge_after)
+        if first in done and first.exception() is None:
+            return first.result()
+        logger.debug(f"Hedging request to '{candidates[0]}' with {candidates[1:]}")
+        second = self._hedge_pool.submit(self._call_in_order, prompt, candidates[1:])
+        for future in as_completed([first, second]):
+            if future.exception() is None:
+                return future.result()
+        raise second.exception()
+
+    def _call_in_order(self, prompt: str, candidates: list[str]) -> tuple[str, str]:
+        for position, candidate in enumerate(candidates):
+            try:
+                return self._call_model(prompt, candidate), candidate
+            except Exception as exception:
+                if position == len(candidates) - 1:
+                    raise
+                logger.warning(f"'{candidate}' failed, falling back to '{candidates[position + 1]}': {exception}")
+
+    def _call_model(self, prompt: str, model_name: str) -> str:
+        provider = MODEL_PROVIDERS.get(model_name)
+        if provider not in self.providers:
+            raise ValueError(f"LLM model '{model_name}' is not yet supported")
+
+        def timed_call() -> str:
+            start = time.monotonic()
+            try:
+                response = self.providers[provider](prompt, model_name)
+            except Exception:
+                self.router.record(model_name, time.monotonic() - start, ok=False)
+                raise
+            self.router.record(model_name, time.monotonic() - start, ok=True)
+            return response
+        return self.retry_policy.call(f"{provider}/{model_name}", timed_call)
+
+
+    def call_many(self, prompts: list[str], mock_response: Optional[str] = None, model_name: Optional[str] = None) -> list[str]:
+        """Call the LLM for each prompt through a bounded thread pool and return the responses in prompt order.
+
+        The pool size is the model's entry in model_concurrency, falling back to max_concurrency.
+        Cost estimation runs serially, since it makes no API calls.
+
+        A failed prompt does not abort the others: every call runs to completion, and if any failed a
+        PartialResponsesError is raised with the completed responses, so already-paid work can be kept.
+        Completed responses also reach the response cache as they arrive when caching is on.
+        """
+        if model_name is None:
+            model_name = self.model_name
+        max_workers = min(self.model_concurrency.get(model_name, self.max_concurrency), len(prompts))
+        if self.cost_estimation_mode:
+            return [self.call(prompt, mock_response=mock_response, model_name=model_name) for prompt in prompts]
+        responses = [None] * len(prompts)
+        errors = {}
+        if max_workers <= 1:
+            for position, prompt in enumerate(prompts):
+                try:
+                    responses[position] = self.call(prompt, mock_response=mock_response, model_name=model_name)
+                except Exception as exception:
+                    errors[position] = exception
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self.call, prompt, mock_response, model_name) for prompt in prompts]
+                for position, future in enumerate(futures):
+                    if future.exception() is None:
+                        responses[position] = future.result()
+                    else:
+                        errors[position] = future.exception()
+        if len(errors) > 0:
+            logger.error(f"{len(errors)} of {len(prompts)} LLM calls failed")
+            raise PartialResponsesError(responses, errors)
+        return responses
+
+    def call_batch(self, prompts: dict[str, str], mock_response: Optional[str] = None, model_name: Optional[str] = None) -> dict[str, str]:
+        """Generate responses for {custom_id: prompt} through the provider's Batch API and return {custom_id: response}.
+
+        The prompts are uploaded as one JSONL file, the batch is polled until it finishes, and the output file
+        is joined back by custom_id. Models without a Batch API, and cost estimation, go through call_many instead.
+        """
+        if model_name is None:
+            model_name = self.model_name
+        if self.cost_estimation_mode or MODEL_PROVIDERS.get(model_name) != "openai":
+            return dict(zip(prompts.keys(), self.call_many(list(prompts.values()), mock_response=mock_response, model_name=model_name)))
+
+        responses = self._cache_lookup(prompts, model_name) if self._use_cache() else {}
+        for request_id in responses:
+            self._record_served(prompts[request_id], model_name)
+        pending = {request_id: prompt for request_id, prompt in prompts.items() if request_id not in responses}
+        if len(pending) > 0:
+            batch_responses = self._run_batch(pending, model_name)
+            if self._use_cache():
+                self._cache_store(pending, batch_responses, model_name)
+            responses.update(batch_responses)
+        return {request_id: responses[request_id] for request_id in prompts}
+
+    def _run_batch(self, prompts: dict[str, str], model_name: str) -> dict[str, str]:
+        headers = {'Authorization': f'Bearer {self.openai_api_key}'}
+        lines = [
+            json.dumps({
+                'custom_id': request_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': model_name,
+                    'messages': [{"role": "user", "content": prompt}],
+                    'max_tokens': self.max_tokens,
+                    'temperature': self.temperature,
+                    'top_p': self.top_p
+                }
+            })
+            for request_id, prompt in prompts.items()
+        ]
+
+        def request(method: str, path: str, **kwargs) -> requests.Response:
+            def send() -> requests.Response:
+                response = self.session.request(method, f"{self.batch_api_base}{path}", headers=headers, timeout=self.timeout, **kwargs)
+                response.raise_for_status()
+                return response
+            return self.retry_policy.call("openai/batch", send)
+
+        input_file_id = request(
+            "POST", "/files",
+            data={'purpose': 'batch'},
+            files={'file': ('batch.jsonl', "\n".join(lines).encode(), 'application/jsonl')}
+        ).json()['id']
+        batch = request(
+            "POST", "/batches",
+            json={'input_file_id': input_file_id, 'endpoint': '/v1/chat/completions', 'completion_window': '24h'}
+        ).json()
+        logger.info(f"Submitted batch '{batch['id']}' with {len(prompts)} requests to {self.batch_api_base}")
+
+        deadline = time.monotonic() + self.batch_timeout
+        while batch['status'] not in ['completed', 'failed', 'expired', 'cancelled']:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Batch '{batch['id']}' did not finish within {self.batch_timeout} seconds")
+            time.sleep(self.batch_poll_interval)
+            batch = request("GET", f"/batches/{batch['id']}").json()
+            logger.debug(f"Batch '{batch['id']}' status: {batch['status']} {batch.get('request_counts')}")
+        if batch['status'] != 'completed':
+            raise RuntimeError(f"Batch '{batch['id']}' ended with status '{batch['status']}': {batch.get('errors')}")
+
+        results = {}
+        for file_id in [batch.get('output_file_id'), batch.get('error_file_id')]:
+            if file_id is None:
+                continue
+            for line in request("GET", f"/files/{file_id}/content").text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                body = (result.get('response') or {}).get('body') or {}
+                if result.get('error') is None and 'choices' in body:
+                    results[result['custom_id']] = body['choices'][0]['message']['content'].strip()
+                    self._record_served(prompts[result['custom_id']], model_name)
+                else:
+                    logger.warning(f"Batch request '{result['custom_id']}' failed: {result.get('error') or body.get('error')}")
+        failed = [request_id for request_id in prompts if request_id not in results]
+        if len(failed) > 0:
+            # requests that failed inside the batch are retried one by one, with backoff
+            logger.warning(f"Batch '{batch['id']}' has no result for {len(failed)} requests, calling them directly")
+            responses = self.call_many([prompts[request_id] for request_id in failed], model_name=model_name)
+            results.update(zip(failed, responses))
+        return results
 
     def _call_gpt(self, prompt, model_name):
         #alter the endpoint, hyperparameters, and response based on the model name
@@ -94,32 +453,57 @@ class LLMClient:
         else:
             raise ValueError(f"LLM model '{model_name}' is not supported")
 
-        try:
-            response = requests.post(endpoint, headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
-            generated_response = result['choices'][0]['message']['content'].strip()
-            return generated_response
-        except requests.exceptions.RequestException as exception:
-            logger.error(f"Error calling API: {exception}")
-            return f"Error: {exception}"
+        response = self.session.post(endpoint, headers=headers, json=data, timeout=self.timeout)
+        response.raise_for_status()
+        result = response.json()
+        generated_response = result['choices'][0]['message']['content'].strip()
+        return generated_response
+
+    def _gemini_model(self, model_name: str) -> genai.GenerativeModel:
+        """GenerativeModel for model_name, created once per client; the API key is configured on first use."""
+        with self._gemini_lock:
+            if len(self._gemini_models) == 0:
+                configure(api_key=self.gemini_api_key)
+            if model_name not in self._gemini_models:
+                self._gemini_models[model_name] = genai.GenerativeModel(model_name)
+            return self._gemini_models[model_name]
 
     def _call_gemini(self, message, model_name):
-        try:
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(message)
-            generated_response = response.text.strip()
-            return generated_response
-        except Exception as exception:
-            logger.error(f"Error calling Gemini API: {exception}")
-            return f"Error: {exception}"    
+        model = self._gemini_model(model_name)
+        response = model.generate_content(message, request_options={"timeout": self.timeout[1]})
+        generated_response = response.text.strip()
+        return generated_response
+
 
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the response cache, and the API spend the hits avoided."""
+        if self.cache is None:
+            return {}
+        return {**self.cache.stats(), "dollars_saved": self.dollars_saved}
+
+    def close(self) -> None:
+        if self.cost_recorder is not None:
+            self.cost_recorder.flush()
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        if len(self.fallback_models) > 0:
+            logger.info(f"LLM router stats: { {name: self.router.stats(name) for name in [self.model_name, *self.fallback_models]} }")
+        if self.cache is None:
+            return
+        stats = self.cache_stats()
+        logger.info(f"LLM response cache stats: {stats}")
+        if stats["hits"] + stats["misses"] > 0:
+            self.tracking_client.log_artifact(data={"run_id": self.dagster_run_id_, **stats}, filename=self._cache_stats_filename, asset_key="llm/cache_stats")
+        self.cache.close()
 
     def call_baseline_feedback(self, prompt):
         return self.call(prompt, model_name='gpt-4o', mock_response=MockLLMResponse.FEEDBACK.name)
 
+    def call_baseline_feedback_many(self, prompts: list[str]) -> list[str]:
+        return self.call_many(prompts, model_name='gpt-4o', mock_response=MockLLMResponse.FEEDBACK.name)
+
 
-class LLM(ConfigurableResource):
+class LLM(ProviderResource):
     model_name: str = 'gpt-4o'
     max_tokens: int = 600
     temperature: float = 0.8
@@ -128,6 +512,28 @@ class LLM(ConfigurableResource):
     tracking_client: ResourceDependency[TrackingClient]
     openai_api_key: str = EnvVar("OPENAI_API_KEY")
     gemini_api_key: str = EnvVar("GOOGLE_API_KEY")
+    # completions take longer than the other provider calls
+    read_timeout: float = 120.0
+    # requests in flight at once for call_many, with optional per-model overrides
+    max_concurrency: int = 8
+    model_concurrency: dict[str, int] = {}
+    # persistent response cache; 'deterministic' only serves cached responses when temperature is 0
+    cache_policy: str = Field(default="never", examples=CACHE_POLICIES)
+    cache_path: str = ".cache/llm_responses.sqlite"
+    cache_max_entries: int = 200_000
+    # submit bulk feedback generation through the provider's Batch API (OpenAI models only)
+    batch_mode: bool = False
+    batch_api_base: str = "https://api.openai.com/v1"
+    batch_poll_interval: float = 30.0
+    batch_timeout: float = 24 * 3600
+    # opt-in routing: other models that may serve requests for model_name when they are faster or healthier,
+    # and seconds after which a slow request is hedged with a second one to the next candidate
+    fallback_models: list[str] = []
+    hedge_after: Optional[float] = None
+    max_error_rate: float = 0.2
+    # cost estimates are written to one parquet file per step, rewritten every this many calls (None: only at teardown)
+    cost_checkpoint_every: Optional[int] = 1000
+    _client: Optional[LLMClient] = PrivateAttr(default=None)
 
     def create_resource(self, context: InitResourceContext) -> LLMClient:
         
@@ -141,7 +547,7 @@ class LLM(ConfigurableResource):
         # with open("artifacts/run_configurations/configs.json", "w") as f:
         #     json.dump(run_configs, f, indent=4)
         
-        return LLMClient(
+        self._client = LLMClient(
             model_name=self.model_name,
             max_tokens=self.max_tokens,
             temperature=self.temperature,
@@ -150,8 +556,28 @@ class LLM(ConfigurableResource):
             gemini_api_key=self.gemini_api_key,
             cost_estimation_mode=self.cost_estimation_mode,
             tracking_client=self.tracking_client,
-            dagster_run_id=context.run_id
+            dagster_run_id=context.run_id,
+            **self.connection_kwargs(),
+            max_concurrency=self.max_concurrency,
+            model_concurrency=self.model_concurrency,
+            # cost estimation makes no API calls, so there is nothing to cache
+            cache=DiskCache(self.cache_path, self.cache_max_entries) if self.cache_policy != "never" and not self.cost_estimation_mode else None,
+            cache_policy=self.cache_policy,
+            batch_mode=self.batch_mode,
+            batch_api_base=self.batch_api_base,
+            batch_poll_interval=self.batch_poll_interval,
+            batch_timeout=self.batch_timeout,
+            retry_policy=self.retry_policy(),
+            fallback_models=self.fallback_models,
+            hedge_after=self.hedge_after,
+            max_error_rate=self.max_error_rate,
+            cost_checkpoint_every=self.cost_checkpoint_every
         )
+        return self._client
+
+    def teardown_after_execution(self, context: InitResourceContext) -> None:
+        if self._client is not None:
+            self._client.close()
 
 class MockLLMResponse(Enum):
 
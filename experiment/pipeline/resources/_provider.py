@@ -0,0 +1,36 @@
+from dagster import ConfigurableResource
+from ._resilience import RetryPolicy
+
+
+class ProviderResource(ConfigurableResource):
+    """Configuration shared by resources that call a model provider's HTTP API."""
+
+    # keep-alive connection pool shared by every client in the process, and per-request timeouts in seconds
+    pool_size: int = 10
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+    # retries with jittered exponential backoff on rate limits and server errors, and a per-endpoint circuit breaker
+    max_retries: int = 5
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 60.0
+    call_deadline: float = 600.0
+    circuit_failure_threshold: int = 5
+    circuit_reset_timeout: float = 60.0
+
+    def connection_kwargs(self) -> dict:
+        """Client keyword arguments for the connection pool and timeouts."""
+        return {
+            "pool_size": self.pool_size,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+        }
+
+    def retry_policy(self) -> RetryPolicy:
+        return RetryPolicy(
+            max_retries=self.max_retries,
+            base_delay=self.retry_base_delay,
+            max_delay=self.retry_max_delay,
+            deadline=self.call_deadline,
+            failure_threshold=self.circuit_failure_threshold,
+            reset_timeout=self.circuit_reset_timeout
+        )
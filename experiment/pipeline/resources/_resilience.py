@@ -0,0 +1,196 @@
+from dagster import get_dagster_logger
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Callable, Optional, TypeVar
+from botocore.exceptions import ClientError
+import requests
+import random
+import threading
+import time
+
+
+logger = get_dagster_logger()
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: rate limits and transient server errors
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_AWS_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException", "ModelNotReadyException", "InternalServerException"}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+    def __init__(self, message: str, retry_in: float) -> None:
+        super().__init__(message)
+        # seconds until the breaker may let a call through again
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Stops calls to an endpoint after repeated retryable failures.
+
+    After failure_threshold consecutive failures the circuit opens and calls fail fast with CircuitOpenError.
+    Once reset_timeout seconds have passed, one trial call is let through: success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 60.0) -> None:
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial_in_flight:
+                # while a trial call is in flight, check back after a fraction of the reset timeout
+                retry_in = remaining if remaining > 0 else min(1.0, self.reset_timeout)
+                raise CircuitOpenError(f"Circuit for '{self.endpoint}' is open, retry in {retry_in:.0f}s", retry_in)
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_flight:
+                    logger.error(f"Opening circuit for '{self.endpoint}' after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+_breakers: dict[tuple[str, int, float], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(endpoint: str, failure_threshold: int = 5, reset_timeout: float = 60.0) -> CircuitBreaker:
+    """
+    Process-wide circuit breaker for an endpoint such as "openai/embeddings" or "openai/gpt-4o", created on first use.
+
+    Breakers are shared only between callers that use the same endpoint and thresholds.
+    """
+    key = (endpoint, failure_threshold, reset_timeout)
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(endpoint, failure_threshold, reset_timeout)
+        return _breakers[key]
+
+
+def is_retryable(exception: Exception) -> bool:
+    if isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exception, requests.exceptions.HTTPError) and exception.response is not None:
+        return exception.response.status_code in RETRYABLE_STATUSES
+    if isinstance(exception, ClientError):
+        status = exception.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return exception.response.get("Error", {}).get("Code") in RETRYABLE_AWS_CODES or status in RETRYABLE_STATUSES
+    # google.api_core exceptions carry the HTTP status as an int code
+    code = getattr(exception, "code", None)
+    return isinstance(code, int) and code in RETRYABLE_STATUSES
+
+
+def retry_after(exception: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, from a Retry-After header in seconds or as an HTTP date."""
+    response = getattr(exception, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers or headers.get("Retry-After") is None:
+        return None
+    value = headers["Retry-After"]
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+def is_throttled(exception: Exception) -> bool:
+    """A 429 with Retry-After: the provider is up but rate limiting us."""
+    response = getattr(exception, "response", None)
+    return getattr(response, "status_code", None) == 429 and retry_after(exception) is not None
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff for provider calls.
+
+    A call is attempted up to max_retries + 1 times. Between attempts it waits for the provider's Retry-After
+    when given, otherwise a random delay in [0.5, 1] times base_delay * 2^attempt, capped at max_delay.
+    No retry is started that would end past deadline seconds from the first attempt.
+
+    While the endpoint's circuit is open, calls wait for it to half-open (within the same deadline)
+    rather than failing. Throttling responses with Retry-After do not count toward opening the circuit.
+    """
+
+    def __init__(
+            self,
+            max_retries: int = 5,
+            base_delay: float = 1.0,
+            max_delay: float = 60.0,
+            deadline: Optional[float] = 600.0,
+            failure_threshold: int = 5,
+            reset_timeout: float = 60.0
+            ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def backoff(self, attempt: int, exception: Exception) -> float:
+        requested = retry_after(exception)
+        if requested is not None:
+            return requested
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def call(self, endpoint: str, fn: Callable[[], T]) -> T:
+        """Run fn, retrying retryable failures, behind the endpoint's circuit breaker."""
+        breaker = circuit_breaker(endpoint, self.failure_threshold, self.reset_timeout)
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                breaker.before_call()
+            except CircuitOpenError as exception:
+                elapsed = time.monotonic() - start
+                if self.deadline is not None and elapsed + exception.retry_in > self.deadline:
+                    logger.error(f"Giving up on '{endpoint}' after {elapsed:.1f}s: {exception}")
+                    raise
+                time.sleep(exception.retry_in)
+                continue
+            try:
+                result = fn()
+            except Exception as exception:
+                if not is_retryable(exception) or is_throttled(exception):
+                    # the provider answered, e.g. a bad request or a rate limit, so it is not down
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                if not is_retryable(exception):
+                    raise
+                delay = self.backoff(attempt, exception)
+                elapsed = time.monotonic() - start
+                if attempt >= self.max_retries or (self.deadline is not None and elapsed + delay > self.deadline):
+                    logger.error(f"Giving up on '{endpoint}' after {attempt + 1} attempts in {elapsed:.1f}s: {exception}")
+                    raise
+                logger.warning(f"Retryable error from '{endpoint}' (attempt {attempt + 1}), retrying in {delay:.1f}s: {exception}")
+                time.sleep(delay)
+                attempt += 1
+            else:
+                breaker.record_success()
+                return result
@@ -0,0 +1,66 @@
+from collections import deque
+import threading
+import numpy as np
+
+
+# provider that serves each supported model
+MODEL_PROVIDERS = {
+    "gpt-3.5-turbo": "openai",
+    "gpt-4": "openai",
+    "gpt-4o": "openai",
+    "gpt-4-turbo": "openai",
+    "gemini-1.5-flash": "gemini",
+    "gemini-1.5-pro": "gemini",
+}
+
+
+class ModelRouter:
+    """
+    In-process latency and error statistics per model, used to order candidate models for a request.
+
+    Each model keeps its most recent `window` calls. Models are ranked healthy first (error rate below
+    max_error_rate), then by p95 latency. Models with fewer than min_samples calls rank behind every healthy
+    sampled model and keep their configured order among themselves, so traffic only moves away from the
+    configured model once there is data to justify it.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 10) -> None:
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, latency: float, ok: bool) -> None:
+        with self._lock:
+            if model_name not in self._samples:
+                self._samples[model_name] = deque(maxlen=self.window)
+            self._samples[model_name].append((latency, ok))
+
+    def stats(self, model_name: str) -> dict:
+        with self._lock:
+            samples = list(self._samples.get(model_name, []))
+        if len(samples) == 0:
+            return {"samples": 0, "p95_latency": 0.0, "error_rate": 0.0}
+        latencies = [latency for latency, ok in samples if ok]
+        return {
+            "samples": len(samples),
+            "p95_latency": float(np.percentile(latencies, 95)) if len(latencies) > 0 else float("inf"),
+            "error_rate": sum(1 for _, ok in samples if not ok) / len(samples),
+        }
+
+    def rank(self, model_names: list[str], max_error_rate: float = 0.2) -> list[str]:
+        def key(item):
+            position, model_name = item
+            stats = self.stats(model_name)
+            if stats["samples"] < self.min_samples:
+                return (False, float("inf"), position)
+            return (stats["error_rate"] >= max_error_rate, stats["p95_latency"], position)
+        return [model_name for _, model_name in sorted(enumerate(model_names), key=key)]
+
+
+_router = ModelRouter()
+
+
+def model_router() -> ModelRouter:
+    """Process-wide router, so every client in a run learns from the same calls."""
+    return _router
@@ -2,100 +2,538 @@ from dagster import ConfigurableResource, InitResourceContext, get_dagster_logge
 from experiment.pipeline.models import Feedback, FeedbackRequest, ClassDocument
 from ._mlflow import TrackingClient
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+from typing import Iterable, Optional, Union
+from pydantic import BaseModel, Field
+import hashlib
 import json
 import os
+import shutil
+import tempfile
 
 logger = get_dagster_logger()
 
 
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores in each row, best first, using argpartition."""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def _train_centroids(embeddings: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means over unit-norm rows, trained on a sample. Returns unit-norm centroids."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(embeddings), 256 * nlist)
+    sample = embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.bincount(assignments, minlength=nlist) == 0
+        if empty.any():
+            # re-seed empty lists with random points so every list stays in use
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms == 0, 1, norms)
+    return centroids.astype(np.float32)
+
+
+def _assign_lists(embeddings: np.ndarray, centroids: np.ndarray, block_size: int = 65536) -> np.ndarray:
+    """Nearest centroid for every row, computed in blocks to bound the size of the score matrix."""
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), block_size):
+        block = embeddings[start:start + block_size]
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
 class VectorStoreClient:
+    """
+    In-process vector index over feedback or class document chunks.
 
-    def __init__(self, name, source) -> None:
-        
+    The backend is chosen by name:
+    - 'parquet': exact brute-force search over the teacher's rows
+    - 'ivf': IVF-flat approximate search. Rows are clustered into nlist lists by spherical k-means
+      and a query only scores the rows in its nprobe closest lists
+
+    When persist is on, a built index is saved under index_dir keyed by a hash of its inputs and the
+    embedding model, and later runs memory-map it instead of rebuilding it. When the inputs changed,
+    the feedback index is instead derived from the latest persisted one: only feedback reported by
+    missing() needs embeddings, and it is upserted before the result is persisted under the new key.
+
+    The feedback index can also be updated in place with upsert/delete. New rows are appended after
+    the partitioned rows and scanned exhaustively, removed rows are tombstoned, and the index is
+    compacted back into partitions once those rows exceed compaction_threshold of the total.
+    """
+
+    BACKENDS = ['parquet', 'ivf']
+    # fields holding the vectors themselves, left out of the content hash so it can be computed before embedding
+    EMBEDDING_FIELDS = {
+        "feedback_vector_store": ['index_embeddings'],
+        "class_document_vector_store": ['embeddings'],
+    }
+
+    def __init__(
+            self, 
+            name, 
+            source, 
+            nlist: int = 64, 
+            nprobe: int = 8, 
+            persist: bool = True, 
+            index_dir: str = ".cache/vector_store", 
+            compaction_threshold: float = 0.2
+            ) -> None:
+        if name not in self.BACKENDS:
+            raise ValueError(f"Invalid vector store: {name}. Should be one of {self.BACKENDS}")
         self.name = name
         self.source = source
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.persist = persist
+        self.index_dir = index_dir
+        self.compaction_threshold = compaction_threshold
         self._path = None
         self._data_key = None
+        self._embeddings = np.empty((0, 0), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._metadata = pd.DataFrame()
+        self._partitions = {}
+        self._centroids = None
+        self._lists = np.empty(0, dtype=np.int32)
+        self._list_offsets = {}
+        self._deleted = np.empty(0, dtype=bool)
+        self._appended = {}
 
-    def store_feedback(self, embeddings: list[Feedback]) -> None:
+    def store_feedback(self, embeddings: list[Feedback], embedding_model_name: Optional[str] = None) -> None:
         """
         Create a vector store of feedback embeddings (plus metadata)
-        """
-        vectors = pd.DataFrame()
-        emd_id = 0
-        for feedback in embeddings:
-            include_essay_text_in_embeddings = len(feedback.highlighted_text_chunks) == len(feedback.index_text)
-            metadata = feedback.model_dump(exclude=['index_embeddings', 'highlighted_text_chunks', 'index_text', 'highlighted_text'])
-            for idx, embedding in enumerate(feedback.index_embeddings):
-                row_insert = pd.DataFrame({"_id": emd_id, "embedding": [embedding], "text": feedback.index_text[idx], **metadata})
-                if include_essay_text_in_embeddings:
-                    row_insert['highlighted_text_chunk'] = feedback.highlighted_text_chunks[idx]
-                else:
-                    row_insert['highlighted_text_chunk'] = None
-                vectors = pd.concat([vectors, row_insert])
-                emd_id += 1
-        vectors.set_index("_id", inplace=True)
-        logger.info(f"Storing {vectors.shape[0]} feedback embeddings using a {self.name} store")
 
-        self._vectors = vectors
+        If embedding_model_name is given and an index for the same inputs was persisted by an
+        earlier run, it is opened from disk instead of being rebuilt. Otherwise the latest persisted
+        index is updated in place: feedback that is gone is deleted and new or edited feedback, which
+        must carry its embeddings, is upserted. Unchanged feedback needs no embeddings in that case.
+        """
         self._data_key = "feedback_vector_store"
-        if self.name == 'parquet':
-            self._store_parquet(vectors)
+        path = self._index_path(embeddings, embedding_model_name)
+        if path is not None and os.path.exists(path):
+            self._load(path)
+            logger.info(f"Opened {len(self._metadata)} persisted feedback embeddings from {path}")
+            return
+
+        if path is not None and self.open_latest(self._data_key, embedding_model_name):
+            feedback_ids = {fb.feedback_id for fb in embeddings}
+            live_ids = set(self._metadata['feedback_id'][~self._deleted].tolist())
+            removed = sorted(live_ids - feedback_ids)
+            if len(removed) > 0:
+                self.delete(removed)
+            self.upsert(self.missing(embeddings))
+            logger.info(f"Updated the persisted feedback index: {len(removed)} feedback samples removed")
+            self._persist(path, embedding_model_name)
+            return
+
+        vectors, records = self._feedback_rows(embeddings)
+        self._build_index(vectors, records)
+        logger.info(f"Storing {len(records)} feedback embeddings using a {self.name} store")
+
+        if path is not None:
+            self._persist(path, embedding_model_name)
         
     
-    def store_class_context(self, embeddings: list[ClassDocument]) -> None:
-        vectors = pd.DataFrame()
-        emd_id = 0
+    def _feedback_rows(self, feedback: list[Feedback]) -> tuple[list[Iterable], list[dict]]:
+        """One embedding and one metadata record per indexed chunk of each feedback."""
+        unembedded = [fb.feedback_id for fb in feedback if fb.index_embeddings is None]
+        if len(unembedded) > 0:
+            raise ValueError(f"{len(unembedded)} feedback samples have no embeddings and cannot be indexed, e.g. feedback_id {unembedded[0]}")
+        vectors = []
+        records = []
+        for fb in feedback:
+            include_essay_text_in_embeddings = len(fb.highlighted_text_chunks) == len(fb.index_text)
+            metadata = fb.model_dump(exclude=['index_embeddings', 'highlighted_text_chunks', 'index_text', 'highlighted_text'])
+            metadata["content_hash"] = self._content_hash(fb)
+            for idx, embedding in enumerate(fb.index_embeddings):
+                if include_essay_text_in_embeddings:
+                    highlighted_text_chunk = fb.highlighted_text_chunks[idx]
+                else:
+                    highlighted_text_chunk = None
+                records.append({**metadata, "chunk_index": idx, "text": fb.index_text[idx], "highlighted_text_chunk": highlighted_text_chunk})
+                vectors.append(embedding)
+        return vectors, records
+
+    def _content_hash(self, item: BaseModel) -> str:
+        """Hash of everything but the embeddings, the same basis as _index_path, so edited feedback is detected."""
+        return hashlib.sha256(item.model_dump_json(exclude=self.EMBEDDING_FIELDS["feedback_vector_store"]).encode()).hexdigest()
+
+    def missing(self, feedback: list[Feedback]) -> list[Feedback]:
+        """
+        The feedback that is not in the index yet or was edited since it was indexed, i.e. the only
+        feedback that needs embedding before an upsert.
+        """
+        if len(self._metadata) == 0:
+            return feedback
+        if 'content_hash' not in self._metadata:
+            # indexed before content hashes were stored, so edits cannot be told apart
+            return feedback
+        live = self._metadata[~self._deleted]
+        indexed = dict(zip(live['feedback_id'].tolist(), live['content_hash'].tolist()))
+        return [fb for fb in feedback if indexed.get(fb.feedback_id) != self._content_hash(fb)]
+
+    def upsert(self, feedback: list[Feedback]) -> None:
+        """
+        Add embedded feedback to the index, replacing any rows already stored for the same feedback_id.
+
+        New rows are appended without rebuilding the index, and the store is compacted once enough
+        rows live outside the partitions. The result lives in memory until it is persisted, as
+        store_feedback does.
+        """
+        if self._data_key is None:
+            self._data_key = "feedback_vector_store"
+        if self._data_key != "feedback_vector_store":
+            raise ValueError(f"upsert is only supported for the feedback vector store, not {self._data_key}")
+        if len(feedback) == 0:
+            return
+        if len(self._metadata) == 0:
+            vectors, records = self._feedback_rows(feedback)
+            self._build_index(vectors, records)
+            self._path = None
+            return
+
+        self._tombstone([fb.feedback_id for fb in feedback])
+        vectors, records = self._feedback_rows(feedback)
+        if len(records) > 0:
+            embeddings = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(embeddings, axis=1).astype(np.float32)
+            embeddings /= np.where(norms == 0, 1, norms)[:, None]
+            start = len(self._metadata)
+            metadata = pd.DataFrame.from_records(records)
+            metadata.index = pd.RangeIndex(self._metadata.index.max() + 1, self._metadata.index.max() + 1 + len(records), name="_id")
+
+            # appended rows sit outside any list (-1) and are always scanned for their teacher
+            self._embeddings = np.concatenate([self._embeddings, embeddings])
+            self._norms = np.concatenate([self._norms, norms])
+            self._lists = np.concatenate([self._lists, np.full(len(records), -1, dtype=np.int32)])
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(records), dtype=bool)])
+            self._metadata = pd.concat([self._metadata, metadata])
+            for offset, user_id in enumerate(metadata['user_id']):
+                self._appended.setdefault(user_id, []).append(start + offset)
+        # the index no longer matches what was persisted
+        self._path = None
+        logger.info(f"Upserted {len(records)} feedback embeddings from {len(feedback)} feedback samples")
+        self._maybe_compact()
+
+    def delete(self, feedback_id: Union[int, list[int]]) -> None:
+        """Remove every row stored for the given feedback_id(s) from search results."""
+        feedback_ids = [feedback_id] if isinstance(feedback_id, int) else feedback_id
+        self._tombstone(feedback_ids)
+        self._path = None
+        self._maybe_compact()
+
+    def _tombstone(self, feedback_ids: list[int]) -> None:
+        if len(self._metadata) == 0:
+            return
+        rows = self._metadata['feedback_id'].isin(feedback_ids).to_numpy()
+        self._deleted |= rows
+
+    def _maybe_compact(self) -> None:
+        outside_partitions = int(self._deleted.sum()) + sum(len(rows) for rows in self._appended.values())
+        if outside_partitions > self.compaction_threshold * len(self._metadata):
+            self.compact()
+
+    def compact(self) -> None:
+        """Drop tombstoned rows and fold appended rows back into the teacher partitions."""
+        live = ~self._deleted
+        vectors = np.asarray(self._embeddings[live]) * self._norms[live][:, None]
+        records = self._metadata[live].to_dict('records')
+        logger.info(f"Compacting {self._data_key}: {int(self._deleted.sum())} deleted rows dropped, {len(records)} rows kept")
+        self._build_index(vectors, records)
+        self._path = None
+
+    def store_class_context(self, embeddings: list[ClassDocument], embedding_model_name: Optional[str] = None) -> None:
+        self._data_key = "class_document_vector_store"
+        path = self._index_path(embeddings, embedding_model_name)
+        if path is not None and os.path.exists(path):
+            self._load(path)
+            logger.info(f"Opened {len(self._metadata)} persisted class context embeddings from {path}")
+            return
+
+        vectors = []
+        records = []
         for document in embeddings:
             # TODO : temporary, remove when class context is ready
             if document.embeddings is None:
                 continue
             metadata = document.model_dump(exclude=['embeddings', 'chunks', 'content'])
             for idx, embedding in enumerate(document.embeddings):
-                row_insert = pd.DataFrame({"_id": emd_id, "embedding": [embedding], "text": document.chunks[idx], **metadata})
-                vectors = pd.concat([vectors, row_insert])
-                emd_id += 1
+                records.append({**metadata, "chunk_index": idx, "text": document.chunks[idx]})
+                vectors.append(embedding)
+        self._build_index(vectors, records)
+        logger.info(f"Storing {len(records)} class context embeddings using a {self.name} store")
+
+        if path is not None:
+            self._persist(path, embedding_model_name)
+
+    def _build_index(self, vectors: Union[list[Iterable], np.ndarray], records: list[dict]) -> None:
+        """
+        Build the index in a single pass: one contiguous float32 matrix holding the embeddings,
+        and a metadata table whose row i describes row i of the matrix.
+
+        Rows are L2-normalized once here so cosine similarity is a plain dot product at query time.
+        The original norms are kept to recover raw dot-product scores. Rows are grouped by user_id
+        so that each teacher's vectors are one contiguous slice, looked up through self._partitions.
+        For the 'ivf' backend, rows are further grouped by inverted list within each slice.
+        """
         if len(vectors) > 0:
-            vectors.set_index("_id", inplace=True)
-        logger.info(f"Storing {vectors.shape[0]} class context embeddings using a {self.name} store")
+            embeddings = np.asarray(vectors, dtype=np.float32)
+        else:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1) if embeddings.size > 0 else np.empty(0, dtype=np.float32)
+        norms = norms.astype(np.float32)
+        embeddings /= np.where(norms == 0, 1, norms)[:, None]
+        metadata = pd.DataFrame.from_records(records)
+        metadata.index.name = "_id"
 
-        self._vectors = vectors
-        self._data_key = "class_document_vector_store"
-        if self.name == 'parquet':
-            self._store_parquet(vectors)
+        # cluster rows into inverted lists (a single list when searching exhaustively)
+        centroids = None
+        lists = np.zeros(len(metadata), dtype=np.int32)
+        if self.name == 'ivf' and len(metadata) > 0:
+            centroids = _train_centroids(embeddings, min(self.nlist, len(metadata)))
+            lists = _assign_lists(embeddings, centroids)
+        nlist = 1 if centroids is None else len(centroids)
+
+        # partition by teacher: each user's rows form one contiguous slice of the matrix,
+        # sorted by list within the slice so every (user, list) pair is contiguous too
+        partitions = {}
+        list_offsets = {}
+        if len(metadata) > 0:
+            codes, users = pd.factorize(metadata['user_id'])
+            order = np.lexsort((lists, codes))
+            counts = np.bincount(codes * nlist + lists, minlength=len(users) * nlist)
+            offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            for i, user in enumerate(users):
+                partitions[user] = slice(int(offsets[i * nlist]), int(offsets[(i + 1) * nlist]))
+                list_offsets[user] = offsets[i * nlist:(i + 1) * nlist + 1]
+            embeddings = np.ascontiguousarray(embeddings[order])
+            norms = norms[order]
+            lists = lists[order]
+            metadata = metadata.iloc[order]
+
+        self._embeddings = embeddings
+        self._norms = norms
+        self._metadata = metadata
+        self._partitions = partitions
+        self._centroids = centroids
+        self._lists = lists
+        self._list_offsets = list_offsets
+        self._deleted = np.zeros(len(metadata), dtype=bool)
+        self._appended = {}
+
+    @property
+    def path(self) -> Optional[str]:
+        """Directory the index is memory-mapped from, or None while it only lives in memory."""
+        return self._path
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return the live rows of the index as a single DataFrame (metadata plus an embedding column), e.g. for logging."""
+        live = ~self._deleted
+        embeddings = self._embeddings[live] * self._norms[live][:, None]
+        return self._metadata[live].assign(embedding=list(embeddings))
     
-    def _store_parquet(self, vectors: pd.DataFrame):
-        if self.source == 'local':
+    def is_persisted(self, data_key: str, items: list[BaseModel], embedding_model_name: Optional[str]) -> bool:
+        """Whether an index for these (not yet embedded) items was already persisted under data_key."""
+        self._data_key = data_key
+        path = self._index_path(items, embedding_model_name)
+        return path is not None and os.path.exists(path)
+
+    def _config_digest(self, embedding_model_name: str):
+        digest = hashlib.sha256()
+        digest.update(json.dumps({"name": self.name, "nlist": self.nlist, "embedding_model": embedding_model_name}).encode())
+        return digest
+
+    def _index_path(self, items: list[BaseModel], embedding_model_name: Optional[str]) -> Optional[str]:
+        """Directory of the persisted index for these inputs, or None if the index should not be persisted."""
+        if not self.persist or embedding_model_name is None or self.source != 'local':
+            return None
+        digest = self._config_digest(embedding_model_name)
+        for item in items:
+            digest.update(item.model_dump_json(exclude=self.EMBEDDING_FIELDS[self._data_key]).encode())
+        return os.path.join(self.index_dir, self._data_key, digest.hexdigest()[:32])
+
+    def _latest_pointer(self, embedding_model_name: str) -> str:
+        """File naming the most recently persisted index for this backend and embedding model."""
+        return os.path.join(self.index_dir, self._data_key, f"latest-{self._config_digest(embedding_model_name).hexdigest()[:32]}")
+
+    def open_latest(self, data_key: str, embedding_model_name: Optional[str]) -> bool:
+        """Open the most recently persisted index for data_key and the embedding model, if there is one."""
+        self._data_key = data_key
+        if not self.persist or embedding_model_name is None or self.source != 'local':
+            return False
+        pointer = self._latest_pointer(embedding_model_name)
+        if not os.path.exists(pointer):
+            return False
+        with open(pointer, "r") as f:
+            path = f.read().strip()
+        if not os.path.exists(path):
+            return False
+        self._load(path)
+        logger.info(f"Opened the latest persisted {data_key} index with {int((~self._deleted).sum())} rows from {path}")
+        return True
+
+    def _persist(self, path: str, embedding_model_name: Optional[str] = None) -> None:
+        """
+        Save the index as .npy matrices plus a metadata sidecar, then reopen it memory-mapped.
+
+        Tombstoned and appended rows are saved as they are, so an upserted index is persisted without compacting it.
+        """
+        if len(self._metadata) == 0:
             return
-            # file_name = f"{self._data_key}.parquet"
-            # self.tracking_client.log_artifact(data=vectors, filename=file_name, asset_key=self._data_key)
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        # write to a temporary directory and rename, so concurrent runs never see a partial index
+        staging = tempfile.mkdtemp(dir=parent)
+        np.save(os.path.join(staging, "embeddings.npy"), self._embeddings)
+        np.save(os.path.join(staging, "norms.npy"), self._norms)
+        np.save(os.path.join(staging, "lists.npy"), self._lists)
+        np.save(os.path.join(staging, "deleted.npy"), self._deleted)
+        if self._centroids is not None:
+            np.save(os.path.join(staging, "centroids.npy"), self._centroids)
+        self._metadata.to_parquet(os.path.join(staging, "metadata.parquet"))
+        layout = {
+            "partitions": {user: [partition.start, partition.stop] for user, partition in self._partitions.items()},
+            "list_offsets": {user: offsets.tolist() for user, offsets in self._list_offsets.items()},
+            "appended": {user: [int(row) for row in rows] for user, rows in self._appended.items()},
+        }
+        with open(os.path.join(staging, "layout.json"), "w") as f:
+            json.dump(layout, f)
+        try:
+            os.rename(staging, path)
+            logger.info(f"Persisted {self._data_key} index to {path}")
+        except OSError:
+            # another run persisted the same index first
+            shutil.rmtree(staging, ignore_errors=True)
+        if embedding_model_name is not None:
+            # point later runs at this index, so they can update it instead of rebuilding
+            pointer = self._latest_pointer(embedding_model_name)
+            with tempfile.NamedTemporaryFile("w", dir=parent, delete=False) as f:
+                f.write(path)
+            os.replace(f.name, pointer)
+        self._load(path)
+
+    def _load(self, path: str) -> None:
+        """Open a persisted index. The matrices are memory-mapped, so nothing is copied up front."""
+        self._embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        self._norms = np.load(os.path.join(path, "norms.npy"), mmap_mode='r')
+        self._lists = np.load(os.path.join(path, "lists.npy"), mmap_mode='r')
+        centroids_path = os.path.join(path, "centroids.npy")
+        self._centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        self._metadata = pd.read_parquet(os.path.join(path, "metadata.parquet"))
+        with open(os.path.join(path, "layout.json"), "r") as f:
+            layout = json.load(f)
+        self._partitions = {user: slice(start, stop) for user, (start, stop) in layout["partitions"].items()}
+        self._list_offsets = {user: np.asarray(offsets, dtype=np.int64) for user, offsets in layout["list_offsets"].items()}
+        deleted_path = os.path.join(path, "deleted.npy")
+        # loaded into memory, since deletes update it in place
+        self._deleted = np.load(deleted_path) if os.path.exists(deleted_path) else np.zeros(len(self._metadata), dtype=bool)
+        self._appended = {user: list(rows) for user, rows in layout.get("appended", {}).items()}
+        self._path = path
+
+    def __getstate__(self) -> dict:
+        # a persisted index travels between steps as its path and is memory-mapped again on arrival
+        state = self.__dict__.copy()
+        if self._path is not None:
+            for key in ['_embeddings', '_norms', '_lists', '_centroids', '_metadata', '_partitions', '_list_offsets', '_deleted', '_appended']:
+                state.pop(key)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self._path is not None:
+            self._load(self._path)
     
-    def _search(self, queries: list[FeedbackRequest], score: str, threshold: float, top_k: int) -> pd.DataFrame:
+    def _search(self, queries: list[FeedbackRequest], score: str, threshold: float, top_k: int, nprobe: Optional[int] = None) -> pd.DataFrame:
         if self.source == 'local':
-            vectors = self._vectors
-            results = pd.DataFrame()
-            for query in queries:
-                search_embedding = query.search_query_embedding
-                search_text = query.search_query_text
-                text_selection = query.text_selection
-                instruction = query.instruction
-                teacher_id = query.user_id
-                authorized_vectors = vectors[vectors['user_id'] == teacher_id]
-                if score == 'cosine':
-                    authorized_vectors['score'] = authorized_vectors['embedding'].apply(lambda x: cosine_similarity([x], [search_embedding])[0][0])
-                elif score == 'dot-product':
-                    authorized_vectors['score'] = authorized_vectors['embedding'].apply(lambda x: np.dot([x], [search_embedding]))
+            if score not in ['cosine', 'dot-product']:
+                raise ValueError(f"Invalid score type: {score}. Should be one of ['cosine', 'dot-product']")
+            queries = [query for query in queries if query.search_query_embedding is not None]
+            if len(self._metadata) == 0 or len(queries) == 0 or top_k <= 0:
+                return pd.DataFrame()
+            if nprobe is None:
+                nprobe = self.nprobe
+            exhaustive = self._centroids is None or nprobe >= len(self._centroids)
+
+            # stack every query into one matrix, normalized for cosine like the stored rows
+            query_matrix = np.asarray([query.search_query_embedding for query in queries], dtype=np.float32)
+            if score == 'cosine':
+                query_norms = np.linalg.norm(query_matrix, axis=1)
+                query_matrix /= np.where(query_norms == 0, 1, query_norms)[:, None]
+
+            # queries are only scored against the rows of the teacher who made them
+            queries_by_teacher = {}
+            for position, query in enumerate(queries):
+                queries_by_teacher.setdefault(query.user_id, []).append(position)
+
+            hit_queries, hit_rows, hit_scores = [], [], []
+            for teacher_id, positions in queries_by_teacher.items():
+                partition = self._partitions.get(teacher_id, slice(0, 0))
+                appended = np.asarray(self._appended.get(teacher_id, []), dtype=np.int64)
+                if partition.stop == partition.start and appended.size == 0:
+                    continue
+                teacher_queries = query_matrix[positions]
+                probed = None
+                if exhaustive and appended.size == 0:
+                    rows = np.arange(partition.start, partition.stop)
+                    candidates = self._embeddings[partition]
+                elif exhaustive:
+                    rows = np.concatenate([np.arange(partition.start, partition.stop), appended])
+                    candidates = self._embeddings[rows]
                 else:
-                    raise ValueError(f"Invalid score type: {score}. Should be one of ['cosine', 'dot-product']")
-                query_results = authorized_vectors.sort_values(by='score', ascending=False).head(top_k)  # TODO: change to score
-                query_results = query_results[query_results['score'] >= threshold]
-                query_results['request_id'] = query.request_id
-                query_results['query'] = search_text
-                query_results['query_text_selection'] = text_selection
-                query_results['query_instruction'] = instruction
-                results = pd.concat([results, query_results])
+                    # probe the closest lists per query, and score the union of those lists once
+                    probe = _top_k(teacher_queries @ self._centroids.T, nprobe)
+                    list_offsets = self._list_offsets.get(teacher_id)
+                    ranges = [np.arange(list_offsets[l], list_offsets[l + 1]) for l in np.unique(probe)] if list_offsets is not None else []
+                    rows = np.concatenate(ranges + [appended])
+                    if rows.size == 0:
+                        continue
+                    candidates = self._embeddings[rows]
+                    probed = np.zeros((len(positions), len(self._centroids)), dtype=bool)
+                    np.put_along_axis(probed, probe, True, axis=1)
+
+                scores = teacher_queries @ candidates.T
+                if score == 'dot-product':
+                    scores *= self._norms[rows]
+                excluded = np.zeros(scores.shape, dtype=bool)
+                if probed is not None:
+                    # a query may only match rows from the lists it probed itself (appended rows have no list)
+                    row_lists = self._lists[rows]
+                    excluded |= (row_lists >= 0) & ~probed[:, np.maximum(row_lists, 0)]
+                excluded |= self._deleted[rows]
+                scores[excluded] = -np.inf
+                top = _top_k(scores, top_k)
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                found = np.isfinite(top_scores).ravel()
+                hit_queries.append(np.repeat(positions, top.shape[1])[found])
+                hit_rows.append(rows[top].ravel()[found])
+                hit_scores.append(top_scores.ravel()[found])
+            if len(hit_rows) == 0:
+                return pd.DataFrame()
+
+            hit_queries = np.concatenate(hit_queries)
+            hit_rows = np.concatenate(hit_rows)
+            hit_scores = np.concatenate(hit_scores)
+            keep = hit_scores >= threshold
+            # restore request order; hits within a request are already sorted by score
+            order = np.argsort(hit_queries[keep], kind='stable')
+            hit_queries, hit_rows, hit_scores = hit_queries[keep][order], hit_rows[keep][order], hit_scores[keep][order]
+
+            results = self._metadata.iloc[hit_rows].assign(score=hit_scores)
+            results['request_id'] = [queries[position].request_id for position in hit_queries]
+            results['query'] = [queries[position].search_query_text for position in hit_queries]
+            results['query_text_selection'] = [queries[position].text_selection for position in hit_queries]
+            results['query_instruction'] = [queries[position].instruction for position in hit_queries]
             # PATH = f"artifacts/vectors/{self.dagster_run_id}/"
             # if not os.path.exists(PATH):
             #     os.makedirs(PATH)
@@ -106,10 +544,43 @@ class VectorStoreClient:
     def search(self, queries: list[FeedbackRequest], score: str, threshold: float, top_k: int) -> pd.DataFrame:
         return self._search(queries, score, threshold, top_k)
 
+    def evaluate_recall(self, queries: list[FeedbackRequest], score: str, top_k: int) -> float:
+        """
+        Recall@k of the configured search against exact search over the same authorized rows.
+
+        Always 1.0 for the exact backend. Use it to tune nlist/nprobe for 'ivf'.
+        """
+        exact = self._search(queries, score, -np.inf, top_k, nprobe=len(self._centroids) if self._centroids is not None else None)
+        if exact.shape[0] == 0:
+            return 1.0
+        approximate = self._search(queries, score, -np.inf, top_k)
+        if approximate.shape[0] == 0:
+            return 0.0
+        exact_hits = exact.reset_index()[['request_id', '_id']]
+        approximate_hits = approximate.reset_index()[['request_id', '_id']]
+        found = exact_hits.merge(approximate_hits, on=['request_id', '_id']).shape[0]
+        return found / exact_hits.shape[0]
+
 
 class VectorStore(ConfigurableResource):
-    name: str = 'parquet'
+    name: str = Field(default='parquet', examples=VectorStoreClient.BACKENDS)
     source: str = 'local'
+    # IVF parameters, only used when name='ivf'
+    nlist: int = 64
+    nprobe: int = 8
+    # reuse indexes across runs by memory-mapping them from index_dir
+    persist: bool = True
+    index_dir: str = ".cache/vector_store"
+    # compact upserted/deleted rows back into partitions past this fraction of the index
+    compaction_threshold: float = 0.2
     
     def create_resource(self, context: InitResourceContext):
-        return VectorStoreClient(name=self.name, source=self.source)
\ No newline at end of file
+        return VectorStoreClient(
+            name=self.name, 
+            source=self.source, 
+            nlist=self.nlist, 
+            nprobe=self.nprobe, 
+            persist=self.persist, 
+            index_dir=self.index_dir,
+            compaction_threshold=self.compaction_threshold
+            )
\ No newline at end of file
@@ -5,6 +5,7 @@ from ._enums import (
     TeacherModelBaseInstructionStyles,
     TeacherModelUpdateInstructionStyles,
     FeedbackGenerationInstructionStyles,
+    FeedbackGenerationLayouts,
     StudentConferencingInstructionStyles
 )
 from ._builder import PromptLayerBuilder
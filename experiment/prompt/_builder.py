@@ -1,8 +1,15 @@
-from langchain_core.prompts.few_shot import FewShotPromptTemplate
-from langchain_core.prompts.pipeline import PipelinePromptTemplate
-from langchain_core.prompts import PromptTemplate
 from experiment.prompt import PromptLayerPrefixes, PromptLayerTemplates
 from enum import Enum
+from functools import lru_cache
+from string import Formatter
+
+
+@lru_cache(maxsize=None)
+def _compile_template(version: str, name: str) -> tuple[str, frozenset]:
+    """Template string for (version, name) and the fields it expects, parsed once per process."""
+    template = PromptLayerTemplates[version].value[name].value
+    fields = frozenset(field for _, field, _, _ in Formatter().parse(template) if field is not None)
+    return template, fields
 
 
 class PromptLayerBuilder():
@@ -11,32 +18,20 @@ class PromptLayerBuilder():
         self._templates: Enum = PromptLayerTemplates[self.version].value
         self._prefixes: Enum = PromptLayerPrefixes[self.version].value
 
-    def build_few_shot_prompt(self, examples: list[dict], context: str) -> FewShotPromptTemplate:
-        assert context in self._templates.__members__.keys()
+    def render_few_shot(self, examples: list[dict], context: str) -> str:
+        """Render the few-shot section for the context: the prefix and each formatted example, joined by blank lines, with empty pieces left out."""
         assert context in self._templates.__members__.keys()
-        template = self._templates[context].value
+        template, _ = _compile_template(self.version, context)
         prefix = self._prefixes[context].value
-        example_prompt = PromptTemplate.from_template(template)
+        pieces = [prefix, *[template.format(**example) for example in examples]]
+        return "\n\n".join(piece for piece in pieces if piece)
 
-        few_shot_prompt = FewShotPromptTemplate(
-            example_prompt=example_prompt,
-            examples=examples,
-            prefix=prefix,
-            suffix="",
-            input_variables=[]
-        )
-        return few_shot_prompt
-
-    def build_compose_prompt(self, input_prompts: list[tuple], event: str, input_vars: list = []) -> PipelinePromptTemplate:
+    def render_compose(self, sections: dict[str, str], event: str, **inputs) -> str:
+        """Render the event template with the rendered sections and the remaining inputs."""
         assert event in self._templates.__members__.keys()
-        compose_template = self._templates[event].value
-        
-        compose_prompt = PromptTemplate.from_template(compose_template)
-
-        pipeline_prompt = PipelinePromptTemplate(
-            final_prompt=compose_prompt,
-            pipeline_prompts=input_prompts,
-            input_variables=input_vars
-        )
-
-        return pipeline_prompt
\ No newline at end of file
+        template, fields = _compile_template(self.version, event)
+        values = {**sections, **inputs}
+        missing = fields - values.keys()
+        if missing:
+            raise KeyError(f"Missing inputs for '{event}' template: {sorted(missing)}")
+        return template.format(**values)
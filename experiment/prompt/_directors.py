@@ -1,10 +1,9 @@
-from typing import Callable, Optional
-from experiment.prompt import PromptLayerBuilder, TeacherModelBaseInstructionStyles, TeacherModelOutputFormats, TeacherModelUpdateInstructionStyles, FeedbackGenerationInstructionStyles, StudentConferencingInstructionStyles
+from typing import Callable, Iterator, Optional
+from experiment.prompt import PromptLayerBuilder, TeacherModelBaseInstructionStyles, TeacherModelOutputFormats, TeacherModelUpdateInstructionStyles, FeedbackGenerationInstructionStyles, FeedbackGenerationLayouts, StudentConferencingInstructionStyles
 from langchain_core.prompts import PromptTemplate
-import requests
 from dotenv import load_dotenv; load_dotenv()
 import os
-from experiment.utils import num_tokens_for_llm, trim_document_content
+from experiment.utils import num_tokens_for_llm, trim_document_content, pack_documents, http_session, iter_chat_stream
 
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -20,7 +19,7 @@ def call_gpt(prompt: str) -> str:
     headers = {'Content-Type': 'application/json',
                 'Authorization': f'Bearer {OPENAI_API_KEY}'}
 
-    response = requests.post(endpoint, headers=headers, json=data)
+    response = http_session().post(endpoint, headers=headers, json=data, timeout=(10, 120))
     response.raise_for_status()
     result = response.json()
     generated_response = response_formatter(result)
@@ -28,6 +27,23 @@ def call_gpt(prompt: str) -> str:
     return generated_response
 
 
+def call_gpt_stream(prompt: str) -> Iterator[str]:
+    """Like call_gpt, but yields the response text in pieces as the tokens arrive."""
+    endpoint = 'https://api.openai.com/v1/chat/completions'
+    data = {
+        'model': "gpt-4o",
+        'messages': [{"role": "user", "content": prompt}],
+        'max_tokens': 1500,
+        'stream': True
+    }
+    headers = {'Content-Type': 'application/json',
+                'Authorization': f'Bearer {OPENAI_API_KEY}'}
+
+    with http_session().post(endpoint, headers=headers, json=data, timeout=(10, 120), stream=True) as response:
+        response.raise_for_status()
+        yield from iter_chat_stream(response)
+
+
 class TeacherModelBaseDirector():
     def __init__(
             self,
@@ -104,34 +120,36 @@ Here is your task: Summarize the key information from the document below to help
                 class_context = self._summarize_class_context(class_context)
             
             class_context = trim_document_content(class_context, max_tokens=self.max_class_context_tokens, text_key="document_content")
-            class_context_prompt = self._builder.build_few_shot_prompt(class_context, "CLASS_CONTEXT_TEACHER_MODEL")
+            class_context_prompt = self._builder.render_few_shot(class_context, "CLASS_CONTEXT_TEACHER_MODEL")
         else:
-            class_context_prompt = PromptTemplate.from_template("")
+            class_context_prompt = ""
         
         # get onboarding prompt
         if self.include_onboarding:
-            onboarding_prompt = self._builder.build_few_shot_prompt(onboarding, "ONBOARDING")
+            onboarding_prompt = self._builder.render_few_shot(onboarding, "ONBOARDING")
         else:
-            onboarding_prompt = PromptTemplate.from_template("")
+            onboarding_prompt = ""
         
         # get base prompt
-        input_prompts = [("class_context_prompt", class_context_prompt), ("onboarding_prompt", onboarding_prompt)]
-        teacher_model_base_prompt = self._builder.build_compose_prompt(input_prompts, "CREATE", input_vars=["task_instruction", "output_format"])
+        sections = {"class_context_prompt": class_context_prompt, "onboarding_prompt": onboarding_prompt}
 
         teacher_model_base_inputs = {
             "task_instruction": TeacherModelBaseInstructionStyles[self.instruction_style].value,
             "output_format": TeacherModelOutputFormats[self.output_format].value
         }
 
-        teacher_model_base_prompt_str = teacher_model_base_prompt.format(**teacher_model_base_inputs)
+        teacher_model_base_prompt_str = self._builder.render_compose(sections, "CREATE", **teacher_model_base_inputs)
         return teacher_model_base_prompt_str
 
 
 class TeacherModelUpdateDirector():
-    def __init__(self, version: int, instruction_style: str, max_feedback_example_tokens: int = 500):
+    def __init__(self, version: int, instruction_style: str, max_feedback_example_tokens: int = 500, packing_strategy: str = "greedy"):
         self.version = f"V{version}"
         self.instruction_style = instruction_style
         self.max_feedback_example_tokens = max_feedback_example_tokens
+        self.packing_strategy = packing_strategy
+        # tokens used by each packed section of the last built prompt
+        self.packed_tokens: dict[str, int] = {}
 
         self._builder = PromptLayerBuilder(self.version)
     
@@ -144,18 +162,17 @@ class TeacherModelUpdateDirector():
     def build_prompt(self, teacher_model_base: str, feedback_examples: list[dict]) -> str:
         self._validate_build_inputs(feedback_examples)
 
-        feedback_examples = trim_document_content(feedback_examples, max_tokens=self.max_feedback_example_tokens, text_key="highlighted_text")
-        feedback_prompt = self._builder.build_few_shot_prompt(feedback_examples, "FEEDBACK")
+        feedback_examples, self.packed_tokens["feedback"] = pack_documents(feedback_examples, self.max_feedback_example_tokens, text_key="highlighted_text", strategy=self.packing_strategy)
+        feedback_prompt = self._builder.render_few_shot(feedback_examples, "FEEDBACK")
 
-        input_prompts = [("feedback_prompt", feedback_prompt)]
-        teacher_model_update_prompt = self._builder.build_compose_prompt(input_prompts, "UPDATE", input_vars=["teacher_model_base", "task_instruction"])
+        sections = {"feedback_prompt": feedback_prompt}
 
         teacher_model_update_inputs = {
             "task_instruction": TeacherModelUpdateInstructionStyles[self.instruction_style].value,
             "teacher_model_base": teacher_model_base
         }
 
-        teacher_model_update_prompt_str = teacher_model_update_prompt.format(**teacher_model_update_inputs)
+        teacher_model_update_prompt_str = self._builder.render_compose(sections, "UPDATE", **teacher_model_update_inputs)
         return teacher_model_update_prompt_str
 
 
@@ -170,7 +187,9 @@ class FeedbackGenerationDirector():
             instruction_style: str,
             max_essay_context_tokens: int = 500,
             max_class_context_tokens: int = 300,
-            max_feedback_example_tokens: int = 500) -> None:
+            max_feedback_example_tokens: int = 500,
+            packing_strategy: str = "greedy",
+            layout: str = FeedbackGenerationLayouts.DEFAULT.name) -> None:
         self.version = f"V{version}"
         self.include_teacher_model = include_teacher_model
         self.include_few_shot_feedback = include_few_shot_feedback
@@ -180,6 +199,12 @@ class FeedbackGenerationDirector():
         self.max_essay_context_tokens = max_essay_context_tokens
         self.max_class_context_tokens = max_class_context_tokens
         self.max_feedback_example_tokens = max_feedback_example_tokens
+        self.packing_strategy = packing_strategy
+        self.layout = layout
+        # tokens used by each packed section of the last built prompt
+        self.packed_tokens: dict[str, int] = {}
+        # prompt prefix shared within each (assignment, teacher) group of the last build_prompts call
+        self.prefix_report: list[dict] = []
 
         self._builder = PromptLayerBuilder(self.version)
         self._validate_config()
@@ -187,6 +212,9 @@ class FeedbackGenerationDirector():
     def _validate_config(self):
         if not (self.include_class_context_retrieval | self.include_essay_context | self.include_teacher_model | self.include_few_shot_feedback):
             raise ValueError("At least one of 'include_class_context_retrieval', 'include_essay_context', 'include_teacher_model', or 'include_few_shot_feedback' must be True.")
+
+        if self.layout not in FeedbackGenerationLayouts.__members__:
+            raise ValueError(f"Invalid layout. Must be one of: {', '.join(FeedbackGenerationLayouts.__members__.keys())}")
     
     def _validate_build_inputs(self, feedback_request: list[dict], feedback_retrieval_results: list[dict], class_context_retrieval_results: list[dict], essay_context: list[dict]):
         assert "text_selection" in feedback_request, "Each feedback request must have a 'text_selection' key."
@@ -204,6 +232,37 @@ class FeedbackGenerationDirector():
             assert "document_name" in context, "Each essay context document must have a 'document_name' key."
             assert "document_content" in context, "Each essay context document must have a 'document_content' key."
 
+    def _render_feedback_examples(self, feedback_retrieval_results: list[dict]) -> str:
+        if not self.include_few_shot_feedback:
+            return ""
+        feedback_retrieval_results, self.packed_tokens["feedback"] = pack_documents(feedback_retrieval_results, self.max_feedback_example_tokens, text_key="highlighted_text", strategy=self.packing_strategy)
+        return self._builder.render_few_shot(feedback_retrieval_results, "FEEDBACK")
+
+    def _render_class_context(self, class_context_retrieval_results: list[dict]) -> str:
+        if not self.include_class_context_retrieval:
+            return ""
+        class_context_retrieval_results, self.packed_tokens["class_context"] = pack_documents(class_context_retrieval_results, self.max_class_context_tokens, text_key="document_content", strategy=self.packing_strategy)
+        return self._builder.render_few_shot(class_context_retrieval_results, "CLASS_CONTEXT_FEEDBACK_GENERATION")
+
+    def _render_essay_context(self, essay_context: list[dict]) -> str:
+        if not self.include_essay_context:
+            return ""
+        essay_context, self.packed_tokens["essay_context"] = pack_documents(essay_context, self.max_essay_context_tokens, text_key="document_content", strategy=self.packing_strategy)
+        return self._builder.render_few_shot(essay_context, "ESSAY_CONTEXT")
+
+    def _render_teacher_model(self, teacher_model: str) -> str:
+        if not self.include_teacher_model:
+            return ""
+        return self._builder.render_few_shot([{"teacher_model": teacher_model}], "TEACHER_MODEL")
+
+    def _render(self, feedback_request: dict, sections: dict[str, str]) -> str:
+        feedback_generation_inputs = {
+            "task_instruction": FeedbackGenerationInstructionStyles[self.instruction_style].value,
+            "student_text": feedback_request["text_selection"],
+            "teacher_instruction": feedback_request["instruction"]
+        }
+        return self._builder.render_compose(sections, FeedbackGenerationLayouts[self.layout].value, **feedback_generation_inputs)
+
     def build_prompt(
             self, 
             feedback_request: dict, 
@@ -214,50 +273,70 @@ class FeedbackGenerationDirector():
     
         self._validate_build_inputs(feedback_request, feedback_retrieval_results, class_context_retrieval_results, essay_context)
 
-        # get feedback prompt
-        if self.include_few_shot_feedback:
-            feedback_retrieval_results = trim_document_content(feedback_retrieval_results, max_tokens=self.max_feedback_example_tokens, text_key="highlighted_text")
-            feedback_prompt = self._builder.build_few_shot_prompt(feedback_retrieval_results, "FEEDBACK")
-        else:
-            feedback_prompt = PromptTemplate.from_template("")
-
-        # get class context prompt
-        if self.include_class_context_retrieval:
-            class_context_retrieval_results = trim_document_content(class_context_retrieval_results, max_tokens=self.max_class_context_tokens, text_key="document_content")
-            class_context_prompt = self._builder.build_few_shot_prompt(class_context_retrieval_results, "CLASS_CONTEXT_FEEDBACK_GENERATION")
-        else:
-            class_context_prompt = PromptTemplate.from_template("")
-        
-        # get essay context prompt
-        if self.include_essay_context:
-            essay_context = trim_document_content(essay_context, max_tokens=self.max_essay_context_tokens, text_key="document_content")
-            essay_context_prompt = self._builder.build_few_shot_prompt(essay_context, "ESSAY_CONTEXT")
-        else:
-            essay_context_prompt = PromptTemplate.from_template("")
-        
-        if self.include_teacher_model:
-            teacher_model_prompt = self._builder.build_few_shot_prompt([{"teacher_model": teacher_model}], "TEACHER_MODEL")
-        else:
-            teacher_model_prompt = PromptTemplate.from_template("")
-        
-        input_prompts = [
-            ("teacher_model_prompt", teacher_model_prompt),
-            ("class_context_prompt", class_context_prompt),
-            ("feedback_prompt", feedback_prompt),
-            ("essay_context_prompt", essay_context_prompt)
-        ]
-
-        feedback_generation_prompt = self._builder.build_compose_prompt(input_prompts, "FEEDBACK_GENERATION", input_vars=["task_instruction", "student_text", "teacher_instruction"])
-
-        feedback_generation_inputs = {
-            "task_instruction": FeedbackGenerationInstructionStyles[self.instruction_style].value,
-            "student_text": feedback_request["text_selection"],
-            "teacher_instruction": feedback_request["instruction"]
+        sections = {
+            "teacher_model_prompt": self._render_teacher_model(teacher_model),
+            "class_context_prompt": self._render_class_context(class_context_retrieval_results),
+            "feedback_prompt": self._render_feedback_examples(feedback_retrieval_results),
+            "essay_context_prompt": self._render_essay_context(essay_context)
         }
+        return self._render(feedback_request, sections)
 
-        feedback_generation_prompt_str = feedback_generation_prompt.format(**feedback_generation_inputs)
-
-        return feedback_generation_prompt_str
+    def build_prompts(
+            self,
+            feedback_requests: list[dict],
+            teacher_models: dict[str, str],
+            feedback_retrieval_results: dict = {},
+            class_context_retrieval_results: dict = {},
+            essay_context: dict = {}) -> list[str]:
+        """Build the prompts for many requests at once and return them in request order.
+
+        Each request needs 'request_id', 'user_id', 'assignment_id', 'text_selection' and 'instruction'.
+        Retrieval results are keyed by request_id, teacher models by user_id and essay context by
+        assignment_id. The teacher model and essay context sections are rendered once per teacher and
+        assignment and shared by every request that uses them.
+
+        Afterwards, prefix_report holds the length of the prompt prefix shared by the requests of each
+        (assignment, teacher) group with more than one request, the part a provider's prompt cache can reuse.
+        """
+        teacher_model_prompts = {}
+        essay_context_prompts = {}
+        prompts = []
+        for feedback_request in feedback_requests:
+            user_id, assignment_id, request_id = feedback_request["user_id"], feedback_request["assignment_id"], feedback_request["request_id"]
+            if user_id not in teacher_model_prompts:
+                teacher_model_prompts[user_id] = self._render_teacher_model(teacher_models[user_id])
+            if assignment_id not in essay_context_prompts:
+                assignment_essay_context = essay_context.get(assignment_id, [])
+                self._validate_build_inputs(feedback_request, [], [], assignment_essay_context)
+                essay_context_prompts[assignment_id] = self._render_essay_context(assignment_essay_context)
+
+            request_feedback_results = feedback_retrieval_results.get(request_id, [])
+            request_class_context_results = class_context_retrieval_results.get(request_id, [])
+            self._validate_build_inputs(feedback_request, request_feedback_results, request_class_context_results, [])
+            sections = {
+                "teacher_model_prompt": teacher_model_prompts[user_id],
+                "class_context_prompt": self._render_class_context(request_class_context_results),
+                "feedback_prompt": self._render_feedback_examples(request_feedback_results),
+                "essay_context_prompt": essay_context_prompts[assignment_id]
+            }
+            prompts.append(self._render(feedback_request, sections))
+
+        groups = {}
+        for feedback_request, prompt in zip(feedback_requests, prompts):
+            groups.setdefault((feedback_request["assignment_id"], feedback_request["user_id"]), []).append(prompt)
+        self.prefix_report = []
+        for (assignment_id, user_id), group_prompts in groups.items():
+            if len(group_prompts) < 2:
+                continue
+            shared_prefix = os.path.commonprefix(group_prompts)
+            self.prefix_report.append({
+                "assignment_id": assignment_id,
+                "user_id": user_id,
+                "requests": len(group_prompts),
+                "shared_prefix_chars": len(shared_prefix),
+                "shared_prefix_tokens": num_tokens_for_llm(shared_prefix, "gpt-3.5-turbo")
+            })
+        return prompts
 
 
 class StudentConferencingDirector():
@@ -280,16 +359,14 @@ class StudentConferencingDirector():
 
         essay_context = trim_document_content(essay_context, max_tokens=2000, text_key="document_content")
 
-        essay_context_prompt = self._builder.build_few_shot_prompt(essay_context, "ESSAY_CONTEXT_STUDENT_CONFERENCING")
+        essay_context_prompt = self._builder.render_few_shot(essay_context, "ESSAY_CONTEXT_STUDENT_CONFERENCING")
 
-        teacher_model_prompt = self._builder.build_few_shot_prompt([{"teacher_model": teacher_model}], "TEACHER_MODEL_STUDENT_CONFERENCING")
+        teacher_model_prompt = self._builder.render_few_shot([{"teacher_model": teacher_model}], "TEACHER_MODEL_STUDENT_CONFERENCING")
 
-        input_prompts = [
-            ("teacher_model_prompt", teacher_model_prompt),
-            ("essay_context_prompt", essay_context_prompt)
-        ]
-
-        student_conferencing_prompt = self._builder.build_compose_prompt(input_prompts, "STUDENT_CONFERENCING", input_vars=["task_instruction", "student_text", "student_query"])
+        sections = {
+            "teacher_model_prompt": teacher_model_prompt,
+            "essay_context_prompt": essay_context_prompt
+        }
 
         student_conferencing_inputs = {
             "task_instruction": StudentConferencingInstructionStyles[self.instruction_style].value,
@@ -298,7 +375,7 @@ class StudentConferencingDirector():
             "teacher_feedback": teacher_feedback
         }
 
-        student_conferencing_prompt_str = student_conferencing_prompt.format(**student_conferencing_inputs)
+        student_conferencing_prompt_str = self._builder.render_compose(sections, "STUDENT_CONFERENCING", **student_conferencing_inputs)
 
         return student_conferencing_prompt_str
 
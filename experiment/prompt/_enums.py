@@ -70,6 +70,28 @@ TASK: {task_instruction}
 
 ---------------------------
 
+STUDENT ESSAY TEXT: {student_text}
+TEACHER INSTRUCTION: {teacher_instruction}
+FEEDBACK: 
+"""
+
+    # same sections as FEEDBACK_GENERATION, ordered from most to least shared between requests,
+    # so requests from one teacher and assignment share a long prompt prefix
+    FEEDBACK_GENERATION_PREFIX_CACHE = """
+TASK: {task_instruction}
+
+---------------------------
+
+{teacher_model_prompt}
+
+{essay_context_prompt}
+
+{class_context_prompt}
+
+{feedback_prompt}
+
+---------------------------
+
 STUDENT ESSAY TEXT: {student_text}
 TEACHER INSTRUCTION: {teacher_instruction}
 FEEDBACK: 
@@ -174,6 +196,30 @@ Your updated profile should maintain the format of the existing teacher persona.
 # FEEDBACK
 """
 
+    # same sections as FEEDBACK_GENERATION, ordered from most to least shared between requests,
+    # so requests from one teacher and assignment share a long prompt prefix
+    FEEDBACK_GENERATION_PREFIX_CACHE = """
+# TASK
+{task_instruction}
+
+# INFORMATION ABOUT THE TEACHER
+{teacher_model_prompt}
+
+{essay_context_prompt}
+
+{class_context_prompt}
+
+{feedback_prompt}
+
+# STUDENT ESSAY TEXT
+{student_text}
+
+# TEACHER INSTRUCTION
+{teacher_instruction}
+
+# FEEDBACK
+"""
+
 
 
 
@@ -222,6 +268,13 @@ class PromptLayerPrefixes(Enum):
     V2 = PromptLayerPrefixesV2
 
 
+# ===================== LAYOUT ENUMS =====================
+class FeedbackGenerationLayouts(Enum):
+    """Template used to compose feedback generation prompts."""
+    DEFAULT = "FEEDBACK_GENERATION"
+    PREFIX_CACHE = "FEEDBACK_GENERATION_PREFIX_CACHE"
+
+
 # ===================== INSTRUCTION ENUMS =====================
 class TeacherModelOutputFormats(Enum):
     PARAGRAPH = "Please format the output as a coherent paragraph."
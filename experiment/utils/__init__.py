@@ -1,19 +1,182 @@
+from functools import lru_cache
+from typing import Callable, Hashable, Iterable, Iterator, Optional, TypeVar
+from requests.adapters import HTTPAdapter
+import json
+import random
+import requests
 import tiktoken
 
 
+T = TypeVar("T")
+
+
+@lru_cache(maxsize=None)
+def encoding_for_llm(llm: str) -> tiktoken.Encoding:
+    """Tokenizer for the given model, loaded once per process."""
+    return tiktoken.encoding_for_model(llm)
+
+
 def num_tokens_for_llm(string: str, llm: str) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model(llm)
-    num_tokens = len(encoding.encode(string))
+    encoding = encoding_for_llm(llm)
+    num_tokens = len(encoding.encode(string, disallowed_special=()))
     return num_tokens
 
 
+def count_tokens(strings: list[str], llm: str = "gpt-3.5-turbo") -> list[int]:
+    """Returns the number of tokens in each text string, encoding them as one batch."""
+    if len(strings) == 0:
+        return []
+    encoding = encoding_for_llm(llm)
+    return [len(tokens) for tokens in encoding.encode_batch(strings, disallowed_special=())]
+
+
+def truncate_tokens(string: str, max_tokens: int, llm: str = "gpt-3.5-turbo") -> str:
+    """Returns the longest prefix of the text string that fits in max_tokens tokens."""
+    encoding = encoding_for_llm(llm)
+    tokens = encoding.encode(string, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return string
+    return encoding.decode(tokens[:max_tokens])
+
+
+@lru_cache(maxsize=None)
+def http_session(pool_size: int = 10) -> requests.Session:
+    """Process-wide HTTP session with keep-alive, one per pool size, so repeated API calls reuse connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def iter_chat_stream(response: requests.Response) -> Iterator[str]:
+    """Yield the content deltas of a streamed OpenAI chat completion (server-sent events) as they arrive."""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            break
+        choices = json.loads(payload).get("choices") or []
+        if len(choices) > 0:
+            content = choices[0].get("delta", {}).get("content")
+            if content:
+                yield content
+
+
 def trim_document_content(documents: list[dict], max_tokens: int, text_key: str) -> list[dict]:
-    # calculate what to trim each document to achieve max_tokens across all documents
-    total_document_text = " ".join([context[text_key] for context in documents])
-    total_document_tokens = num_tokens_for_llm(total_document_text, "gpt-3.5-turbo")
-    if total_document_tokens > max_tokens:
+    # when the documents exceed max_tokens in total, give each an equal share of the budget
+    token_counts = count_tokens([document[text_key] for document in documents])
+    if sum(token_counts) > max_tokens:
         max_tokens_per_document = max_tokens // len(documents)
-        for context in documents:
-            context[text_key] = context[text_key][:max_tokens_per_document] + "..."
-    return documents
\ No newline at end of file
+        for document, num_tokens in zip(documents, token_counts):
+            if num_tokens > max_tokens_per_document:
+                document[text_key] = truncate_tokens(document[text_key], max_tokens_per_document) + "..."
+    return documents
+
+
+PACKING_STRATEGIES = ["greedy", "knapsack"]
+
+
+def _truncate_words(string: str, max_tokens: int) -> str:
+    """Token-accurate truncation that backs off to the last whole word."""
+    truncated = truncate_tokens(string, max_tokens - 1)
+    if truncated == string:
+        return string
+    cut = truncated.rstrip().rfind(" ")
+    return (truncated[:cut] if cut > 0 else truncated).rstrip() + "..."
+
+
+def pack_documents(
+        documents: list[dict],
+        max_tokens: int,
+        text_key: str,
+        score_key: str = "score",
+        strategy: str = "greedy",
+        min_partial_tokens: int = 50) -> tuple[list[dict], int]:
+    """Select documents to fill a token budget, preferring high scores, and return (packed documents, tokens used).
+
+    'greedy' takes documents by descending score while they fit; 'knapsack' picks the subset with the
+    highest total score that fits. Either way, leftover budget of at least min_partial_tokens is given to
+    the best remaining document, truncated at a word boundary. Documents without a score weigh 1.0.
+    Packed documents keep their input order and the input dicts are not modified.
+    """
+    if strategy not in PACKING_STRATEGIES:
+        raise ValueError(f"Packing strategy must be one of {PACKING_STRATEGIES}, got '{strategy}'")
+    if len(documents) == 0:
+        return [], 0
+    token_counts = count_tokens([document[text_key] for document in documents])
+    scores = [float(document.get(score_key, 1.0)) for document in documents]
+    # highest score first, ties keep the input order
+    by_score = sorted(range(len(documents)), key=lambda i: (-scores[i], i))
+
+    if strategy == "greedy":
+        selected = set()
+        used = 0
+        for i in by_score:
+            if used + token_counts[i] <= max_tokens:
+                selected.add(i)
+                used += token_counts[i]
+    else:
+        # 0/1 knapsack over token cost; capacity is bucketed so the table stays small for large budgets
+        unit = max(1, max_tokens // 2048)
+        capacity = max_tokens // unit
+        costs = [-(-count // unit) for count in token_counts]
+        best = [0.0] * (capacity + 1)
+        keep = [[False] * (capacity + 1) for _ in documents]
+        for i, cost in enumerate(costs):
+            for c in range(capacity, cost - 1, -1):
+                if best[c - cost] + scores[i] > best[c]:
+                    best[c] = best[c - cost] + scores[i]
+                    keep[i][c] = True
+        selected = set()
+        c = capacity
+        for i in reversed(range(len(documents))):
+            if keep[i][c]:
+                selected.add(i)
+                c -= costs[i]
+        used = sum(token_counts[i] for i in selected)
+
+    packed = {i: documents[i] for i in selected}
+    remaining = max_tokens - used
+    leftover = [i for i in by_score if i not in selected]
+    if len(leftover) > 0 and remaining >= min_partial_tokens:
+        i = leftover[0]
+        text = _truncate_words(documents[i][text_key], remaining)
+        packed[i] = {**documents[i], text_key: text}
+        used += count_tokens([text])[0]
+    return [packed[i] for i in sorted(packed)], used
+
+
+def group_by(items: Iterable[T], key: Callable[[T], Hashable]) -> dict[Hashable, list[T]]:
+    """Group items by key in one pass, keeping their input order within each group."""
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return groups
+
+
+def reservoir_sample_by(
+        items: Iterable[T],
+        key: Callable[[T], Hashable],
+        k: int,
+        rng: Optional[random.Random] = None) -> dict[Hashable, list[T]]:
+    """Uniformly sample up to k items per key in one pass, without materialising each group (Algorithm R).
+
+    Groups with k items or fewer are returned whole, in input order.
+    """
+    rng = rng or random
+    samples = {}
+    seen = {}
+    for item in items:
+        group = key(item)
+        reservoir = samples.setdefault(group, [])
+        seen[group] = seen.get(group, 0) + 1
+        if len(reservoir) < k:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(seen[group])
+            if j < k:
+                reservoir[j] = item
+    return samples
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""Local stand-in for the OpenAI Batch API
+
+Implements the endpoints LLMClient.call_batch uses (file upload, batch create/retrieve, file content)
+and answers every chat completion with a canned response, so batch mode can be exercised without an API key.
+
+Run it, then point the LLM resource at it:
+    python scripts/mock_batch_server.py --port 8765
+    llm: batch_mode=True, batch_api_base="http://127.0.0.1:8765/v1"
+
+Requests can be made to fail (reported in the batch's error file) or go missing from the output
+with --fail-id/--drop-id, to exercise how the client recovers them.
+"""
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import threading
+import time
+import uuid
+
+
+FILES = {}
+BATCHES = {}
+LOCK = threading.Lock()
+# seconds a batch stays in_progress before it completes
+PROCESSING_TIME = 2.0
+# custom_ids answered in the error file instead of the output file
+FAILING_IDS = set()
+# custom_ids left out of both files
+DROPPED_IDS = set()
+
+
+def complete(request: dict) -> dict:
+    prompt = request["body"]["messages"][-1]["content"]
+    return {
+        "id": f"batch_req_{uuid.uuid4().hex}",
+        "custom_id": request["custom_id"],
+        "response": {
+            "status_code": 200,
+            "body": {
+                "model": request["body"]["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": f"MOCKED BATCH RESPONSE ({len(prompt)} prompt chars)"}}],
+            },
+        },
+        "error": None,
+    }
+
+
+def fail(request: dict) -> dict:
+    return {
+        "id": f"batch_req_{uuid.uuid4().hex}",
+        "custom_id": request["custom_id"],
+        "response": {
+            "status_code": 500,
+            "body": {"error": {"message": "MOCKED BATCH FAILURE", "type": "server_error"}},
+        },
+        "error": None,
+    }
+
+
+class BatchHandler(BaseHTTPRequestHandler):
+
+    def _send(self, payload, status: int = 200, content_type: str = "application/json") -> None:
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self) -> None:
+        if self.path == "/v1/files":
+            # multipart/form-data upload, parsed as a MIME message
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + self._body()
+            )
+            content = next(part.get_content() for part in message.iter_parts() if part.get_param("name", header="content-disposition") == "file")
+            file_id = f"file-{uuid.uuid4().hex}"
+            with LOCK:
+                FILES[file_id] = content if isinstance(content, bytes) else content.encode()
+            self._send({"id": file_id, "object": "file", "purpose": "batch"})
+        elif self.path == "/v1/batches":
+            request = json.loads(self._body())
+            if request["input_file_id"] not in FILES:
+                self._send({"error": {"message": "input file not found"}}, status=404)
+                return
+            batch_id = f"batch_{uuid.uuid4().hex}"
+            with LOCK:
+                BATCHES[batch_id] = {"id": batch_id, "input_file_id": request["input_file_id"], "created_at": time.time()}
+            self._send(self._batch(batch_id))
+        else:
+            self._send({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def do_GET(self) -> None:
+        parts = self.path.strip("/").split("/")
+        if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in BATCHES:
+            self._send(self._batch(parts[2]))
+        elif parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" and parts[2] in FILES:
+            self._send(FILES[parts[2]], content_type="application/jsonl")
+        else:
+            self._send({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def _batch(self, batch_id: str) -> dict:
+        with LOCK:
+            batch = BATCHES[batch_id]
+            requests = [json.loads(line) for line in FILES[batch["input_file_id"]].decode().splitlines() if line.strip()]
+            if "output_file_id" not in batch and time.time() - batch["created_at"] >= PROCESSING_TIME:
+                answered = [request for request in requests if request["custom_id"] not in DROPPED_IDS]
+                failed = [fail(request) for request in answered if request["custom_id"] in FAILING_IDS]
+                output_file_id = f"file-{uuid.uuid4().hex}"
+                FILES[output_file_id] = "\n".join(json.dumps(complete(request)) for request in answered if request["custom_id"] not in FAILING_IDS).encode()
+                batch["output_file_id"] = output_file_id
+                batch["error_file_id"] = None
+                batch["failed"] = len(failed)
+                if len(failed) > 0:
+                    error_file_id = f"file-{uuid.uuid4().hex}"
+                    FILES[error_file_id] = "\n".join(json.dumps(result) for result in failed).encode()
+                    batch["error_file_id"] = error_file_id
+            done = "output_file_id" in batch
+            return {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": "/v1/chat/completions",
+                "input_file_id": batch["input_file_id"],
+                "status": "completed" if done else "in_progress",
+                "output_file_id": batch.get("output_file_id"),
+                "error_file_id": batch.get("error_file_id"),
+                "request_counts": {
+                    "total": len(requests),
+                    "completed": len(requests) - batch["failed"] if done else 0,
+                    "failed": batch["failed"] if done else 0,
+                },
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI Batch API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-id", action="append", default=[], help="custom_id to report in the error file")
+    parser.add_argument("--drop-id", action="append", default=[], help="custom_id to leave out of the results")
+    args = parser.parse_args()
+    FAILING_IDS.update(args.fail_id)
+    DROPPED_IDS.update(args.drop_id)
+    server = ThreadingHTTPServer((args.host, args.port), BatchHandler)
+    print(f"Mock batch API listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,70 @@
+from experiment.pipeline.resources._llm import LLMClient
+from http.server import ThreadingHTTPServer
+import importlib.util
+import os
+import threading
+import pytest
+
+
+SERVER_PATH = os.path.join(os.path.dirname(__file__), "..", "scripts", "mock_batch_server.py")
+
+
+@pytest.fixture
+def mock_batch_server():
+    spec = importlib.util.spec_from_file_location("mock_batch_server", SERVER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.PROCESSING_TIME = 0.2
+    # port 0 picks a free port
+    server = ThreadingHTTPServer(("127.0.0.1", 0), module.BatchHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield module, f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def batch_client(batch_api_base: str) -> LLMClient:
+    client = LLMClient(
+        model_name="gpt-4o",
+        max_tokens=100,
+        temperature=0.0,
+        top_p=1.0,
+        openai_api_key="test",
+        gemini_api_key="test",
+        cost_estimation_mode=False,
+        tracking_client=None,
+        batch_mode=True,
+        batch_api_base=batch_api_base,
+        batch_poll_interval=0.05,
+        batch_timeout=10,
+    )
+    # requests the batch did not answer are called directly; answer them locally instead of calling OpenAI
+    client.providers["openai"] = lambda prompt, model_name: f"DIRECT RESPONSE ({len(prompt)} prompt chars)"
+    return client
+
+
+def test_call_batch_matches_custom_ids(mock_batch_server):
+    _, batch_api_base = mock_batch_server
+    prompts = {"a": "x", "b": "xx" * 10, "c": "xxx" * 100}
+
+    responses = batch_client(batch_api_base).call_batch(prompts)
+
+    assert list(responses) == list(prompts)
+    for request_id, prompt in prompts.items():
+        assert responses[request_id] == f"MOCKED BATCH RESPONSE ({len(prompt)} prompt chars)"
+
+
+def test_call_batch_retries_failed_and_missing_requests(mock_batch_server):
+    server, batch_api_base = mock_batch_server
+    server.FAILING_IDS.add("failed")
+    server.DROPPED_IDS.add("dropped")
+    prompts = {"ok": "x", "failed": "xx", "dropped": "xxx"}
+
+    responses = batch_client(batch_api_base).call_batch(prompts)
+
+    assert responses == {
+        "ok": "MOCKED BATCH RESPONSE (1 prompt chars)",
+        "failed": "DIRECT RESPONSE (2 prompt chars)",
+        "dropped": "DIRECT RESPONSE (3 prompt chars)",
+    }
@@ -0,0 +1,61 @@
+from experiment.pipeline.resources._cache import DiskCache, content_key
+import time
+
+
+def test_content_key_separates_parts():
+    assert content_key("ab", "c") != content_key("a", "bc")
+    assert content_key("model", 0.0, "prompt") == content_key("model", 0.0, "prompt")
+
+
+def test_get_many_returns_present_keys_and_counts_hits(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    cache.set_many({"a": b"1", "b": b"2"})
+
+    assert cache.get_many(["a", "b", "c"]) == {"a": b"1", "b": b"2"}
+    assert cache.get("c") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_entries_persist_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = DiskCache(path, max_entries=10)
+    cache.set("a", b"1")
+    cache.close()
+
+    assert DiskCache(path, max_entries=10).get("a") == b"1"
+
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    for i in range(10):
+        cache.set(str(i), b"x")
+        time.sleep(0.001)
+    # reading 0 makes 1 the least recently used entry
+    cache.get("0")
+
+    cache.set("new", b"x")
+
+    kept = cache.get_many([str(i) for i in range(10)] + ["new"])
+    assert len(kept) == int(10 * DiskCache.EVICT_TO)
+    assert "0" in kept and "new" in kept
+    assert "1" not in kept
+
+
+def test_replacing_entries_does_not_evict(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_entries=3)
+    cache.set_many({"a": b"1", "b": b"2", "c": b"3"})
+    for _ in range(5):
+        cache.set("a", b"4")
+
+    assert cache.get_many(["a", "b", "c"]) == {"a": b"4", "b": b"2", "c": b"3"}
+
+
+def test_reopened_full_cache_evicts_on_next_write(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    DiskCache(path, max_entries=100).set_many({str(i): b"x" for i in range(10)})
+
+    cache = DiskCache(path, max_entries=10)
+    cache.set("new", b"x")
+
+    assert len(cache.get_many([str(i) for i in range(10)] + ["new"])) == int(10 * DiskCache.EVICT_TO)
@@ -0,0 +1,45 @@
+from experiment.pipeline.resources._cache import DiskCache
+from experiment.pipeline.resources._embedding_model import EmbeddingModelClient
+import io
+import json
+
+
+class FakeBedrock:
+    def __init__(self):
+        self.requests = []
+
+    def invoke_model(self, body, **kwargs):
+        request = json.loads(body)
+        self.requests.append(request)
+        offset = 1.0 if request["input_type"] == "search_query" else 0.0
+        embeddings = [[offset + i, 1.0] for i, _ in enumerate(request["texts"])]
+        return {"body": io.BytesIO(json.dumps({"embeddings": embeddings}).encode())}
+
+
+def cohere_client(tmp_path) -> EmbeddingModelClient:
+    client = EmbeddingModelClient(
+        model_name="cohere.embed-english-v3",
+        openai_api_key="test",
+        cost_estimation_mode=False,
+        dagster_run_id=None,
+        tracking_client=None,
+        region_name="us-east-1",
+        cache=DiskCache(str(tmp_path / "embeddings.sqlite"), max_entries=100),
+        # one text per request, so batching needs no token counts
+        max_batch_size=1,
+    )
+    client.client = FakeBedrock()
+    return client
+
+
+def test_cohere_queries_are_embedded_as_search_queries(tmp_path):
+    client = cohere_client(tmp_path)
+
+    documents = client.embed(["text"])
+    queries = client.embed(["text"], input_type="search_query")
+
+    assert [request["input_type"] for request in client.client.requests] == ["search_document", "search_query"]
+    # query and document vectors of the same text are cached separately
+    assert documents != queries
+    assert client.embed(["text"], input_type="search_query") == queries
+    assert len(client.client.requests) == 2
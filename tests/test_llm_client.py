@@ -0,0 +1,34 @@
+from experiment.pipeline.resources._llm import LLMClient, PartialResponsesError
+import pytest
+
+
+def local_client(**kwargs) -> LLMClient:
+    return LLMClient(
+        model_name="gpt-4o",
+        max_tokens=100,
+        temperature=0.0,
+        top_p=1.0,
+        openai_api_key="test",
+        gemini_api_key="test",
+        cost_estimation_mode=False,
+        tracking_client=None,
+        **kwargs
+    )
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_call_many_keeps_completed_responses_when_a_prompt_fails(max_concurrency):
+    client = local_client(max_concurrency=max_concurrency)
+
+    def answer(prompt, model_name):
+        if prompt == "bad":
+            raise ValueError("bad request")
+        return prompt.upper()
+    client.providers["openai"] = answer
+
+    with pytest.raises(PartialResponsesError) as raised:
+        client.call_many(["a", "bad", "c"])
+
+    assert raised.value.responses == ["A", None, "C"]
+    assert list(raised.value.errors) == [1]
+    assert isinstance(raised.value.errors[1], ValueError)
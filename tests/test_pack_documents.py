@@ -0,0 +1,84 @@
+from experiment import utils
+from experiment.utils import pack_documents
+import pytest
+
+
+class WordEncoding:
+    """One token per whitespace-separated word, so budgets can be checked without downloading a tokenizer."""
+
+    def encode(self, string: str, disallowed_special=()) -> list[str]:
+        return string.split()
+
+    def encode_batch(self, strings: list[str], disallowed_special=()) -> list[list[str]]:
+        return [self.encode(string) for string in strings]
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(utils, "encoding_for_llm", lambda llm: WordEncoding())
+
+
+def document(name: str, tokens: int, score: float) -> dict:
+    return {"name": name, "text": " ".join([name] * tokens), "score": score}
+
+
+def names(packed: list[dict]) -> list[str]:
+    return [doc["name"] for doc in packed]
+
+
+def test_greedy_takes_best_scores_that_fit_in_input_order():
+    documents = [document("a", 4, 0.1), document("b", 5, 0.9), document("c", 6, 0.5), document("d", 3, 0.4)]
+
+    packed, used = pack_documents(documents, 10, "text", min_partial_tokens=100)
+
+    assert names(packed) == ["b", "d"]
+    assert used == 8
+
+
+def test_knapsack_finds_a_better_subset_than_greedy():
+    documents = [document("a", 6, 3.0), document("b", 5, 2.0), document("c", 5, 2.0)]
+
+    greedy, _ = pack_documents(documents, 10, "text", min_partial_tokens=100)
+    knapsack, used = pack_documents(documents, 10, "text", strategy="knapsack", min_partial_tokens=100)
+
+    assert names(greedy) == ["a"]
+    assert names(knapsack) == ["b", "c"]
+    assert used == 10
+
+
+def test_leftover_budget_goes_to_best_remaining_document_truncated():
+    documents = [document("a", 20, 0.9), document("b", 30, 0.5)]
+    original = [dict(doc) for doc in documents]
+
+    packed, used = pack_documents(documents, 30, "text", min_partial_tokens=5)
+
+    assert names(packed) == ["a", "b"]
+    assert packed[1]["text"].endswith("...")
+    assert used <= 30
+    assert documents == original
+
+
+def test_leftover_below_min_partial_tokens_is_unused():
+    documents = [document("a", 20, 0.9), document("b", 30, 0.5)]
+
+    packed, used = pack_documents(documents, 30, "text", min_partial_tokens=11)
+
+    assert names(packed) == ["a"]
+    assert used == 20
+
+
+def test_documents_without_score_weigh_one():
+    documents = [{"name": "a", "text": "a a a"}, document("b", 3, 0.5)]
+
+    packed, _ = pack_documents(documents, 3, "text", min_partial_tokens=100)
+
+    assert names(packed) == ["a"]
+
+
+def test_empty_and_invalid_strategy():
+    assert pack_documents([], 10, "text") == ([], 0)
+    with pytest.raises(ValueError, match="Packing strategy"):
+        pack_documents([document("a", 1, 1.0)], 10, "text", strategy="random")
@@ -0,0 +1,55 @@
+from experiment.pipeline.resources._rate_limit import RateLimiter
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+
+def timed(fn) -> float:
+    start = time.monotonic()
+    fn()
+    return time.monotonic() - start
+
+
+def test_full_bucket_does_not_block():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=6000)
+
+    assert timed(lambda: [limiter.acquire(100) for _ in range(60)]) < 0.05
+
+
+def test_waits_for_request_quota_to_refill():
+    # 600 requests per minute refill one request every 0.1s
+    limiter = RateLimiter(requests_per_minute=600)
+    for _ in range(600):
+        limiter.acquire()
+
+    assert 0.08 < timed(limiter.acquire) < 0.5
+
+
+def test_waits_for_token_quota_to_refill():
+    # 6000 tokens per minute refill 100 tokens per second
+    limiter = RateLimiter(tokens_per_minute=6000)
+    limiter.acquire(6000)
+
+    assert 0.15 < timed(lambda: limiter.acquire(20)) < 0.6
+
+
+def test_oversized_request_waits_for_a_full_bucket():
+    limiter = RateLimiter(tokens_per_minute=6000)
+
+    assert timed(lambda: limiter.acquire(10 ** 6)) < 0.05
+
+
+def test_no_limits_never_block():
+    limiter = RateLimiter()
+
+    assert timed(lambda: [limiter.acquire(10 ** 6) for _ in range(1000)]) < 0.5
+
+
+def test_threads_share_the_quota():
+    limiter = RateLimiter(requests_per_minute=600)
+    for _ in range(600):
+        limiter.acquire()
+
+    # five more requests need about 0.5s of refill no matter how many threads ask
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        elapsed = timed(lambda: list(pool.map(lambda _: limiter.acquire(), range(5))))
+    assert 0.4 < elapsed < 1.5
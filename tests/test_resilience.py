@@ -0,0 +1,116 @@
+from experiment.pipeline.resources._resilience import RetryPolicy, CircuitBreaker, CircuitOpenError, circuit_breaker
+from uuid import uuid4
+import requests
+import time
+import pytest
+
+
+def http_error(status: int, retry_after: str = None) -> requests.exceptions.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return requests.exceptions.HTTPError(f"{status} error", response=response)
+
+
+def failing(errors: list[Exception], result: str = "ok"):
+    """Callable raising the given errors in turn, then returning result; calls counts the attempts."""
+    def fn():
+        fn.calls += 1
+        if errors:
+            raise errors.pop(0)
+        return result
+    fn.calls = 0
+    return fn
+
+
+@pytest.fixture
+def endpoint():
+    # breakers are process-wide, so every test gets its own endpoint
+    return f"test/{uuid4().hex}"
+
+
+def test_retries_retryable_errors(endpoint):
+    fn = failing([http_error(503), requests.exceptions.ConnectionError()])
+
+    assert RetryPolicy(base_delay=0.001).call(endpoint, fn) == "ok"
+    assert fn.calls == 3
+
+
+def test_raises_non_retryable_errors_at_once(endpoint):
+    fn = failing([http_error(400)])
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        RetryPolicy(base_delay=0.001).call(endpoint, fn)
+    assert fn.calls == 1
+
+
+def test_gives_up_after_max_retries(endpoint):
+    fn = failing([http_error(500)] * 10)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        RetryPolicy(max_retries=2, base_delay=0.001).call(endpoint, fn)
+    assert fn.calls == 3
+
+
+def test_gives_up_when_backoff_would_pass_deadline(endpoint):
+    fn = failing([http_error(429, retry_after="30")])
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        RetryPolicy(deadline=1.0).call(endpoint, fn)
+    assert fn.calls == 1
+
+
+def test_breaker_opens_after_threshold_and_closes_after_trial(endpoint):
+    breaker = CircuitBreaker(endpoint, failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # after the reset timeout one trial call is let through, and others wait for it
+    time.sleep(0.06)
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+
+
+def test_call_waits_for_open_circuit(endpoint):
+    policy = RetryPolicy(max_retries=5, base_delay=0.001, failure_threshold=2, reset_timeout=0.05)
+    fn = failing([http_error(503), http_error(503)])
+
+    # the second failure opens the circuit; the retry waits for it to half-open instead of failing
+    assert policy.call(endpoint, fn) == "ok"
+    assert fn.calls == 3
+
+
+def test_call_gives_up_on_open_circuit_past_deadline(endpoint):
+    breaker = circuit_breaker(endpoint, failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure()
+    fn = failing([])
+
+    with pytest.raises(CircuitOpenError):
+        RetryPolicy(deadline=1.0, failure_threshold=1, reset_timeout=60.0).call(endpoint, fn)
+    assert fn.calls == 0
+
+
+def test_throttling_does_not_open_circuit(endpoint):
+    policy = RetryPolicy(base_delay=0.001, failure_threshold=2, reset_timeout=60.0)
+    fn = failing([http_error(429, retry_after="0")] * 4)
+
+    assert policy.call(endpoint, fn) == "ok"
+    circuit_breaker(endpoint, 2, 60.0).before_call()
+
+
+def test_breakers_are_isolated_per_endpoint(endpoint):
+    circuit_breaker(endpoint, failure_threshold=1, reset_timeout=60.0).record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker(endpoint, 1, 60.0).before_call()
+    circuit_breaker(f"{endpoint}-other", 1, 60.0).before_call()
+    # callers with other thresholds do not share the breaker either
+    circuit_breaker(endpoint, 5, 60.0).before_call()
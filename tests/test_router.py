@@ -0,0 +1,56 @@
+from experiment.pipeline.resources._router import ModelRouter
+
+
+def sampled(router: ModelRouter, model_name: str, latency: float, errors: int = 0, calls: int = 10) -> None:
+    for i in range(calls):
+        router.record(model_name, latency, ok=i >= errors)
+
+
+def test_stats_without_samples():
+    assert ModelRouter().stats("gpt-4o") == {"samples": 0, "p95_latency": 0.0, "error_rate": 0.0}
+
+
+def test_stats_keep_the_latest_window():
+    router = ModelRouter(window=5)
+    sampled(router, "gpt-4o", 10.0, calls=5)
+    sampled(router, "gpt-4o", 1.0, errors=1, calls=5)
+
+    stats = router.stats("gpt-4o")
+
+    assert stats["samples"] == 5
+    assert stats["p95_latency"] == 1.0
+    assert stats["error_rate"] == 0.2
+
+
+def test_stats_with_only_errors_have_infinite_latency():
+    router = ModelRouter()
+    sampled(router, "gpt-4o", 1.0, errors=3, calls=3)
+
+    assert router.stats("gpt-4o")["p95_latency"] == float("inf")
+
+
+def test_rank_prefers_faster_healthy_models():
+    router = ModelRouter(min_samples=5)
+    sampled(router, "gpt-4o", 2.0)
+    sampled(router, "gemini-1.5-flash", 1.0)
+
+    assert router.rank(["gpt-4o", "gemini-1.5-flash"]) == ["gemini-1.5-flash", "gpt-4o"]
+
+
+def test_rank_puts_erroring_models_last():
+    router = ModelRouter(min_samples=5)
+    sampled(router, "gpt-4o", 2.0)
+    sampled(router, "gemini-1.5-flash", 1.0, errors=5)
+
+    assert router.rank(["gemini-1.5-flash", "gpt-4o"]) == ["gpt-4o", "gemini-1.5-flash"]
+    assert router.rank(["gemini-1.5-flash", "gpt-4o"], max_error_rate=0.6) == ["gemini-1.5-flash", "gpt-4o"]
+
+
+def test_rank_keeps_configured_order_until_models_are_sampled():
+    router = ModelRouter(min_samples=5)
+    sampled(router, "gpt-4o", 2.0)
+    sampled(router, "gemini-1.5-flash", 0.1, calls=4)
+
+    # an under-sampled fast model does not jump ahead of a sampled healthy one
+    assert router.rank(["gemini-1.5-pro", "gemini-1.5-flash", "gpt-4o"]) == ["gpt-4o", "gemini-1.5-pro", "gemini-1.5-flash"]
+    assert ModelRouter().rank(["gpt-4", "gpt-4o", "gemini-1.5-pro"]) == ["gpt-4", "gpt-4o", "gemini-1.5-pro"]
@@ -0,0 +1,228 @@
+from experiment.pipeline.models import Feedback, FeedbackRequest
+from experiment.pipeline.resources._vector_store import VectorStoreClient
+from datetime import datetime
+import numpy as np
+import pickle
+import pytest
+
+
+DIMENSIONS = 8
+TEACHERS = ["teacher-a", "teacher-b", "teacher-c"]
+
+
+def make_feedback(feedback_id: int, user_id: str, embedding: np.ndarray, text: str = "feedback") -> Feedback:
+    feedback = Feedback(
+        document_id=1,
+        assignment_id=1,
+        user_id=user_id,
+        highlighted_text="highlighted",
+        feedback_text=text,
+        feedback_id=feedback_id,
+        timestamp=datetime(2024, 1, 1),
+        index_text=[f"{text} {feedback_id}"],
+        highlighted_text_chunks=["highlighted"],
+    )
+    feedback.index_embeddings = [embedding.tolist()]
+    return feedback
+
+
+def make_query(request_id: int, user_id: str, embedding: np.ndarray) -> FeedbackRequest:
+    query = FeedbackRequest(
+        request_id=request_id,
+        user_id=user_id,
+        essay_id=1,
+        assignment_id=1,
+        text_selection="selection",
+        instruction="instruction",
+    )
+    query.search_query_embedding = embedding.tolist()
+    return query
+
+
+def hits(store: VectorStoreClient, queries: list[FeedbackRequest], score: str = "cosine", top_k: int = 5) -> list[tuple]:
+    results = store.search(queries, score, -np.inf, top_k)
+    if results.shape[0] == 0:
+        return []
+    return [(row.request_id, row.feedback_id, round(float(row.score), 4)) for row in results.itertuples()]
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def feedback(rng):
+    return [make_feedback(i, TEACHERS[i % len(TEACHERS)], rng.normal(size=DIMENSIONS)) for i in range(60)]
+
+
+@pytest.fixture
+def queries(rng):
+    return [make_query(i, TEACHERS[i % len(TEACHERS)], rng.normal(size=DIMENSIONS)) for i in range(9)]
+
+
+def built(feedback: list[Feedback], **kwargs) -> VectorStoreClient:
+    store = VectorStoreClient("parquet", "local", persist=False, **kwargs)
+    store.store_feedback(feedback)
+    return store
+
+
+def test_upsert_matches_rebuilt_index(feedback, queries, rng):
+    store = built(feedback[:40], compaction_threshold=1.0)
+    edited = [make_feedback(fb.feedback_id, fb.user_id, rng.normal(size=DIMENSIONS), text="edited") for fb in feedback[:5]]
+    store.upsert(feedback[40:] + edited)
+
+    expected = built(edited + feedback[5:])
+    assert hits(store, queries) == hits(expected, queries)
+
+
+def test_delete_matches_rebuilt_index(feedback, queries):
+    store = built(feedback, compaction_threshold=1.0)
+    store.delete([0, 1, 2])
+    store.delete(10)
+
+    expected = built([fb for fb in feedback if fb.feedback_id not in [0, 1, 2, 10]])
+    assert hits(store, queries) == hits(expected, queries)
+
+
+def test_compact_keeps_results(feedback, queries, rng):
+    store = built(feedback[:40], compaction_threshold=1.0)
+    store.upsert(feedback[40:])
+    store.delete([3, 41])
+    before = hits(store, queries)
+
+    store.compact()
+
+    assert len(store._appended) == 0
+    assert not store._deleted.any()
+    assert hits(store, queries) == before
+
+
+def test_upsert_compacts_past_threshold(feedback):
+    store = built(feedback[:40], compaction_threshold=0.2)
+    store.upsert(feedback[40:])
+
+    assert len(store._appended) == 0
+    assert len(store._metadata) == len(feedback)
+
+
+def test_missing_reports_new_and_edited_feedback(feedback, rng):
+    store = built(feedback[:40])
+    edited = make_feedback(7, feedback[7].user_id, rng.normal(size=DIMENSIONS), text="edited")
+    store.delete(8)
+
+    missing = store.missing(feedback[:7] + [edited, feedback[8]] + feedback[9:])
+
+    assert [fb.feedback_id for fb in missing] == [7, 8] + list(range(40, 60))
+
+
+def test_upsert_requires_embeddings(feedback):
+    store = built(feedback[:40])
+    unembedded = feedback[40].model_copy(update={"index_embeddings": None})
+
+    with pytest.raises(ValueError, match="no embeddings"):
+        store.upsert([unembedded])
+
+
+def test_store_feedback_updates_latest_persisted_index(feedback, queries, rng, tmp_path):
+    first = VectorStoreClient("parquet", "local", index_dir=str(tmp_path))
+    first.store_feedback(feedback[:40], embedding_model_name="model")
+
+    # the next run only embeds what missing() reports, as feedback_embeddings does
+    edited = make_feedback(0, feedback[0].user_id, rng.normal(size=DIMENSIONS), text="edited")
+    current = [edited] + feedback[2:]
+    store = VectorStoreClient("parquet", "local", index_dir=str(tmp_path))
+    assert store.open_latest("feedback_vector_store", "model")
+    to_embed = {fb.feedback_id for fb in store.missing(current)}
+    assert to_embed == {0} | set(range(40, 60))
+    current = [fb if fb.feedback_id in to_embed else fb.model_copy(update={"index_embeddings": None}) for fb in current]
+
+    updated = VectorStoreClient("parquet", "local", index_dir=str(tmp_path))
+    updated.store_feedback(current, embedding_model_name="model")
+
+    assert updated.path is not None and updated.path != first.path
+    expected = built([edited] + feedback[2:])
+    assert hits(updated, queries) == hits(expected, queries)
+    # reopening the persisted update keeps its tombstones and appended rows
+    reopened = VectorStoreClient("parquet", "local", index_dir=str(tmp_path))
+    reopened.store_feedback(current, embedding_model_name="model")
+    assert reopened.path == updated.path
+    assert hits(reopened, queries) == hits(expected, queries)
+
+
+def test_store_feedback_rejects_unembedded_feedback_without_a_persisted_index(feedback, tmp_path):
+    # e.g. feedback_embeddings skipped embedding, then the persisted index was removed
+    unembedded = [fb.model_copy(update={"index_embeddings": None}) for fb in feedback]
+    store = VectorStoreClient("parquet", "local", index_dir=str(tmp_path))
+
+    with pytest.raises(ValueError, match="no embeddings"):
+        store.store_feedback(unembedded, embedding_model_name="model")
+
+
+def brute_force(feedback: list[Feedback], queries: list[FeedbackRequest], score: str, top_k: int = 5) -> list[tuple]:
+    expected = []
+    for query in queries:
+        q = np.asarray(query.search_query_embedding)
+        scored = []
+        for fb in feedback:
+            if fb.user_id != query.user_id:
+                continue
+            row = np.asarray(fb.index_embeddings[0])
+            value = q @ row / (np.linalg.norm(q) * np.linalg.norm(row)) if score == "cosine" else q @ row
+            scored.append((query.request_id, fb.feedback_id, round(float(value), 4)))
+        expected.extend(sorted(scored, key=lambda hit: -hit[2])[:top_k])
+    return expected
+
+
+@pytest.mark.parametrize("score", ["cosine", "dot-product"])
+def test_exact_search_matches_brute_force(feedback, queries, score):
+    store = built(feedback)
+
+    assert hits(store, queries, score) == brute_force(feedback, queries, score)
+
+
+def test_search_applies_threshold(feedback, queries):
+    store = built(feedback)
+    results = store.search(queries, "cosine", 0.5, 5)
+
+    assert (results["score"] >= 0.5).all()
+    assert len(results) == sum(1 for hit in brute_force(feedback, queries, "cosine") if hit[2] >= 0.5)
+
+
+@pytest.mark.parametrize("score", ["cosine", "dot-product"])
+def test_ivf_probing_every_list_matches_exact(feedback, queries, score):
+    store = VectorStoreClient("ivf", "local", nlist=4, nprobe=4, persist=False)
+    store.store_feedback(feedback)
+
+    assert hits(store, queries, score) == hits(built(feedback), queries, score)
+    assert store.evaluate_recall(queries, score, 5) == 1.0
+
+
+def test_ivf_hits_come_from_exact_candidates(feedback, queries):
+    store = VectorStoreClient("ivf", "local", nlist=4, nprobe=1, persist=False)
+    store.store_feedback(feedback)
+    exact = {(request_id, feedback_id): value for request_id, feedback_id, value in brute_force(feedback, queries, "cosine", top_k=len(feedback))}
+
+    approximate = hits(store, queries)
+
+    assert len(approximate) > 0
+    assert all(exact[(request_id, feedback_id)] == value for request_id, feedback_id, value in approximate)
+    assert 0.0 <= store.evaluate_recall(queries, "cosine", 5) <= 1.0
+
+
+@pytest.mark.parametrize("backend", ["parquet", "ivf"])
+def test_persisted_index_is_memory_mapped_and_pickles(feedback, queries, tmp_path, backend):
+    first = VectorStoreClient(backend, "local", nlist=4, index_dir=str(tmp_path))
+    first.store_feedback(feedback, embedding_model_name="model")
+    expected = hits(first, queries)
+
+    reopened = VectorStoreClient(backend, "local", nlist=4, index_dir=str(tmp_path))
+    assert reopened.is_persisted("feedback_vector_store", feedback, "model")
+    reopened.store_feedback(feedback, embedding_model_name="model")
+
+    assert reopened.path == first.path
+    assert isinstance(reopened._embeddings, np.memmap)
+    assert hits(reopened, queries) == expected
+    unpickled = pickle.loads(pickle.dumps(reopened))
+    assert isinstance(unpickled._embeddings, np.memmap)
+    assert hits(unpickled, queries) == expected